@@ -0,0 +1,11 @@
+# Gunicorn settings, read from the working directory: gunicorn src.main:app
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+
+# Try-on status long-polls and event streams hold a request open for up to
+# 25 seconds; threaded workers keep them from pinning a whole process
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+timeout = 60
@@ -0,0 +1,69 @@
+from src.models.user import db
+
+class Product(db.Model):
+    __tablename__ = 'products'
+    __table_args__ = (
+        # Composite indexes for the common "attribute + price range" filters
+        db.Index('ix_products_category_price', 'category', 'price'),
+        db.Index('ix_products_brand_price', 'brand', 'price'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(255), nullable=False)
+    brand = db.Column(db.String(120), index=True)
+    price = db.Column(db.Float, nullable=False, default=0, index=True)
+    original_price = db.Column(db.Float)
+    discount = db.Column(db.Integer)
+    category = db.Column(db.String(120), index=True)
+    color = db.Column(db.String(64), index=True)
+    style = db.Column(db.String(64), index=True)
+    image = db.Column(db.String(512))
+    description = db.Column(db.Text)
+    tags = db.Column(db.JSON)
+    sizes = db.Column(db.JSON)
+    rating = db.Column(db.Float)
+    reviews = db.Column(db.Integer)
+    store_url = db.Column(db.String(512))
+    gender = db.Column(db.String(16))  # audience, e.g. women, men or unisex
+    locale = db.Column(db.String(16))  # market the product is sold in, e.g. ar-SA
+
+    def __repr__(self):
+        return f'<Product {self.id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'brand': self.brand,
+            'price': _number(self.price),
+            'original_price': _number(self.original_price),
+            'discount': self.discount,
+            'category': self.category,
+            'color': self.color,
+            'style': self.style,
+            'image': self.image,
+            'description': self.description,
+            'tags': self.tags or [],
+            'sizes': self.sizes or [],
+            'rating': self.rating,
+            'reviews': self.reviews,
+            'store_url': self.store_url,
+            'gender': self.gender,
+            'locale': self.locale
+        }
+
+def _number(value):
+    """Return whole floats as ints so prices serialize like the in-memory catalog"""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+class CatalogChange(db.Model):
+    """One changed product; the row id is the catalog version the change produced"""
+    __tablename__ = 'catalog_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<CatalogChange {self.id}: product {self.product_id}>'
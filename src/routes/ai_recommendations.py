@@ -1,30 +1,80 @@
 from flask import Blueprint, request, jsonify
+import heapq
 import json
+import threading
 from datetime import datetime
+from src.services.cache import TTLCache
+from src.services.records import ProductView
 
 ai_bp = Blueprint('ai_recommendations', __name__)
 
 # Mock user profiles storage
 user_profiles = {}
 
+# Profile versions, bumped whenever a user's profile changes
+profile_versions = {}
+_profile_lock = threading.Lock()
+
+# Smart search paging and relevance blending
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+RELEVANCE_WEIGHT = 0.6  # share of BM25 relevance in the blended rank
+
+# Per-user recommendation lists, tagged with (profile version, scorer version)
+recommendation_cache = TTLCache(maxsize=10000, ttl=300)
+
+# Smart search price buckets as (min_price, max_price)
+PRICE_RANGES = {
+    '0-50': (None, 50),
+    '50-100': (50, 100),
+    '100-200': (100, 200),
+    '200-500': (200, 500),
+    '500+': (500, None)
+}
+
 @ai_bp.route('/recommendations/<user_id>')
 def get_user_recommendations(user_id):
     """Get personalized recommendations for a specific user"""
     try:
-        # Get user profile
-        user_profile = user_profiles.get(user_id, {})
+        from src.main import catalog, catalog_scorer, cold_start
+        
+        # Read the profile and its version together, so a concurrent update
+        # can't leave old-profile results cached under the new version
+        with _profile_lock:
+            profile_version = profile_versions.get(user_id, 0)
+            user_profile = user_profiles.get(user_id, {})
         
         if not user_profile:
-            # Return default recommendations if no profile exists
-            from src.main import products_db
-            recommendations = products_db[:5]
-            for rec in recommendations:
-                rec['ai_match'] = 85  # Default match score
-                rec['recommendation_reason'] = "توصية عامة بناءً على الشعبية"
+            # Return the precomputed popularity list if no profile exists
+            segment = cold_start_segment(cold_start)
+            products = cold_start.top(5, segment=segment) if cold_start.ready() else catalog.head(5)
+            recommendations = [
+                ProductView(
+                    product,
+                    ai_match=85,  # Default match score
+                    recommendation_reason="توصية عامة بناءً على الشعبية"
+                )
+                for product in products
+            ]
         else:
-            # Get AI-powered recommendations
-            from src.main import FashionAIEngine
-            recommendations = FashionAIEngine.get_recommendations(user_profile, limit=10)
+            # Serve repeat loads from memory until the profile or a scored
+            # product field changes
+            cache_tag = (profile_version, catalog_scorer.version)
+            recommendations = recommendation_cache.get(user_id, tag=cache_tag)
+            
+            if recommendations is None:
+                # Get AI-powered recommendations
+                from src.main import FashionAIEngine
+                recommendations = FashionAIEngine.get_recommendations(user_profile, limit=10)
+                recommendation_cache.set(user_id, recommendations, tag=cache_tag)
+            else:
+                # Cached scores still hold; show the current price and stock
+                current = []
+                for view in recommendations:
+                    product = catalog.get(view['id'])
+                    if product is not None:
+                        current.append(ProductView(product, **view.fields))
+                recommendations = current
         
         return jsonify({
             "status": "success",
@@ -40,27 +90,44 @@ def get_user_recommendations(user_id):
             "message": str(e)
         }), 500
 
+@ai_bp.route('/recommendations/cache-stats')
+def get_recommendation_cache_stats():
+    """Get hit/miss/eviction counters for the recommendation caches"""
+    from src.main import cold_start, profile_score_cache
+    from src.services.json_encoding import product_fragments
+    
+    return jsonify({
+        "status": "success",
+        "cache": recommendation_cache.stats(),
+        "profile_buckets": profile_score_cache.stats(),
+        "product_fragments": product_fragments.stats(),
+        "cold_start": cold_start.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
 @ai_bp.route('/recommendations/feed')
 def get_feed_recommendations():
     """Get general feed recommendations (for non-logged-in users)"""
     try:
-        from src.main import products_db
+        from src.main import catalog, event_counters
         import random
         
-        # Shuffle products and add mock engagement data
+        feed_likes = event_counters.get('feed_likes')
+        
+        # Shuffle products and add engagement data
         feed_items = []
-        for product in products_db:
-            item = {
-                **product,
-                "likes": random.randint(500, 3000),
-                "comments": random.randint(20, 200),
-                "ai_match": random.randint(80, 95),
-                "user": {
+        for product in catalog.products():
+            item = ProductView(
+                product,
+                likes=feed_likes.estimate(product['id']),
+                comments=random.randint(20, 200),
+                ai_match=random.randint(80, 95),
+                user={
                     "name": random.choice(["سارة أحمد", "محمد علي", "ليلى حسن", "أحمد محمود", "فاطمة خالد"]),
                     "avatar": f"https://images.unsplash.com/photo-{random.choice(['1494790108755-2616b612b786', '1507003211169-0a1dd7228f2d', '1438761681033-6461ffad8d80'])}?w=40&h=40&fit=crop&crop=face"
                 },
-                "posted_at": "منذ ساعتين"
-            }
+                posted_at="منذ ساعتين"
+            )
             feed_items.append(item)
         
         # Shuffle for variety
@@ -79,6 +146,34 @@ def get_feed_recommendations():
             "message": str(e)
         }), 500
 
+@ai_bp.route('/recommendations/feed/<int:product_id>/like', methods=['POST'])
+def like_feed_item(product_id):
+    """Record a like on a feed item"""
+    try:
+        from src.main import catalog, event_counters
+        
+        if catalog.get(product_id) is None:
+            return jsonify({
+                "status": "error",
+                "message": "Product not found"
+            }), 404
+        
+        feed_likes = event_counters.get('feed_likes')
+        feed_likes.add(product_id)
+        
+        return jsonify({
+            "status": "success",
+            "product_id": product_id,
+            "likes": feed_likes.estimate(product_id),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @ai_bp.route('/analyze-style', methods=['POST'])
 def analyze_user_style():
     """Analyze user's style preferences and update their profile"""
@@ -93,12 +188,14 @@ def analyze_user_style():
                 "message": "user_id is required"
             }), 400
         
-        # Store/update user profile
-        user_profiles[user_id] = {
-            **user_profiles.get(user_id, {}),
-            **user_data,
-            "last_updated": datetime.now().isoformat()
-        }
+        # Store/update user profile and invalidate cached recommendations
+        with _profile_lock:
+            user_profiles[user_id] = {
+                **user_profiles.get(user_id, {}),
+                **user_data,
+                "last_updated": datetime.now().isoformat()
+            }
+            profile_versions[user_id] = profile_versions.get(user_id, 0) + 1
         
         # Generate style analysis
         analysis = generate_style_analysis(user_data)
@@ -121,66 +218,120 @@ def analyze_user_style():
 def smart_search():
     """AI-powered smart search for fashion items"""
     try:
-        data = request.get_json()
-        query = data.get('query', '')
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                "status": "error",
+                "message": "Request body must be a JSON object"
+            }), 400
+        query = data.get('query') or ''
         user_id = data.get('user_id')
-        filters = data.get('filters', {})
+        filters = data.get('filters') or {}
+        if not isinstance(query, str) or not isinstance(filters, dict):
+            return jsonify({
+                "status": "error",
+                "message": "query must be a string and filters an object"
+            }), 400
+        try:
+            limit = max(1, min(int(data.get('limit', SEARCH_PAGE_SIZE)), MAX_SEARCH_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return jsonify({
+                "status": "error",
+                "message": "limit must be an integer"
+            }), 400
+        try:
+            offset = int(data.get('cursor') or 0)
+        except (TypeError, ValueError):
+            offset = -1
+        if offset < 0:
+            return jsonify({
+                "status": "error",
+                "message": "Invalid cursor"
+            }), 400
+        
+        from src.main import catalog, cold_start, profile_score_cache, search_index, FashionAIEngine
         
-        from src.main import products_db, FashionAIEngine
+        # Filter and resolve against one snapshot, so a concurrent catalog
+        # change can't remove a product between selecting and rendering it
+        snapshot = catalog.snapshot()
         
         # Get user profile for personalization
         user_profile = user_profiles.get(user_id, {}) if user_id else {}
         
-        # Filter products based on search criteria
-        results = []
-        for product in products_db:
-            # Text search
-            if query and query.lower() not in product.get('title', '').lower() and \
-               query.lower() not in ' '.join(product.get('tags', [])).lower():
-                continue
-            
-            # Apply filters
-            if filters.get('category') and product.get('category') != filters['category']:
-                continue
-            if filters.get('color') and product.get('color') != filters['color']:
-                continue
-            if filters.get('style') and product.get('style') != filters['style']:
-                continue
-            if filters.get('price_range'):
-                price = product.get('price', 0)
-                price_range = filters['price_range']
-                if price_range == '0-50' and price > 50:
-                    continue
-                elif price_range == '50-100' and (price < 50 or price > 100):
-                    continue
-                elif price_range == '100-200' and (price < 100 or price > 200):
-                    continue
-                elif price_range == '200-500' and (price < 200 or price > 500):
-                    continue
-                elif price_range == '500+' and price < 500:
-                    continue
+        # Text search resolves through the inverted index
+        has_query = bool(query.strip())
+        matched_ids = search_index.search(query) if has_query else None
+        
+        # Resolve attribute filters through the catalog indexes
+        min_price, max_price = PRICE_RANGES.get(filters.get('price_range'), (None, None))
+        candidate_ids = snapshot.filter_ids(
+            within=matched_ids,
+            category=filters.get('category') or None,
+            color=filters.get('color') or None,
+            style=filters.get('style') or None,
+            min_price=min_price,
+            max_price=max_price
+        )
+        
+        # BM25 relevance, normalized to 0-1 over the matching set
+        relevance = search_index.bm25(query, candidate_ids) if has_query else {}
+        max_relevance = max(relevance.values(), default=0) or 1.0
+        
+        # Personal signal: AI match score with a profile, the precomputed
+        # cold-start popularity score otherwise
+        if user_profile:
+            # Resolve the profile's bucket once for the whole request
+            score_of = profile_score_cache.scorer_for(user_profile)
             
-            # Calculate AI match score if user profile exists
+            def signal(product_id):
+                score = score_of(product_id)
+                return score / 100 if score is not None else 0.0
+        else:
+            signal = cold_start.score_of
+        
+        if has_query:
+            def rank(product_id):
+                return (RELEVANCE_WEIGHT * relevance[product_id] / max_relevance
+                        + (1 - RELEVANCE_WEIGHT) * signal(product_id))
+        else:
+            rank = signal
+        
+        browsing = not user_profile and not has_query and len(candidate_ids) == len(snapshot)
+        if browsing and cold_start.ready() and offset + limit <= cold_start.list_size:
+            # Unfiltered anonymous browsing pages straight through the ranked list
+            page_ids = [product['id'] for product in cold_start.top(limit, offset=offset)]
+        else:
+            # Heap-select only as many results as this page needs
+            page_ids = heapq.nlargest(offset + limit, candidate_ids, key=rank)[offset:]
+        
+        results = []
+        for product_id in page_ids:
+            product = snapshot.get(product_id)
+            if product is None:
+                continue  # the text index can briefly list an id the snapshot lacks
             if user_profile:
-                ai_match = FashionAIEngine.calculate_match_score(user_profile, product)
-                product_result = {**product, "ai_match": ai_match}
+                ai_match = score_of(product_id)
+                if ai_match is None:
+                    ai_match = FashionAIEngine.calculate_match_score(user_profile, product)
             else:
-                product_result = {**product, "ai_match": 85}
-            
+                ai_match = 85
+            product_result = ProductView(product, ai_match=ai_match)
+            if has_query:
+                product_result = product_result.with_fields(relevance=round(relevance[product_id], 4))
             results.append(product_result)
         
-        # Sort by AI match score if user profile exists, otherwise by rating
-        if user_profile:
-            results.sort(key=lambda x: x.get('ai_match', 0), reverse=True)
-        else:
-            results.sort(key=lambda x: x.get('rating', 0), reverse=True)
+        total = len(candidate_ids)
+        next_offset = offset + len(page_ids)
+        next_cursor = str(next_offset) if next_offset < total else None
         
         return jsonify({
             "status": "success",
             "query": query,
             "filters": filters,
             "results": results,
-            "total": len(results),
+            "total": total,
+            "limit": limit,
+            "next_cursor": next_cursor,
             "personalized": bool(user_profile),
             "timestamp": datetime.now().isoformat()
         })
@@ -191,6 +342,36 @@ def smart_search():
             "message": str(e)
         }), 500
 
+@ai_bp.route('/search/suggest')
+def search_suggest():
+    """Typeahead suggestions for the search box"""
+    try:
+        from src.main import suggest_index
+        
+        query = request.args.get('q', '')
+        limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+        
+        return jsonify({
+            "status": "success",
+            "query": query,
+            "suggestions": suggest_index.suggest(query, limit=limit),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+def cold_start_segment(cold_start):
+    """Return the ``(field, value)`` segment named in the query string, if any"""
+    for field in cold_start.segment_fields:
+        value = request.args.get(field)
+        if value:
+            return (field, value)
+    return None
+
 def generate_style_analysis(user_data):
     """Generate AI-powered style analysis for a user"""
     analysis = {
@@ -97,6 +97,10 @@ def get_referral_code(user_id):
 def get_affiliate_links(user_id):
     """Get affiliate links for products"""
     try:
+        from src.main import event_counters
+        
+        affiliate_clicks = event_counters.get('affiliate_clicks')
+        
         # Generate affiliate links for popular products
         products = [
             {"id": 1, "name": "فستان صيفي أنيق", "brand": "Zara", "commission": "5%"},
@@ -117,7 +121,7 @@ def get_affiliate_links(user_id):
                 "brand": product['brand'],
                 "commission_rate": product['commission'],
                 "affiliate_link": affiliate_link,
-                "clicks": random.randint(0, 50),
+                "clicks": affiliate_clicks.estimate(f"{user_id}:{product['id']}"),
                 "conversions": random.randint(0, 5),
                 "earnings": round(random.uniform(0, 25), 2)
             })
@@ -136,6 +140,37 @@ def get_affiliate_links(user_id):
             "message": str(e)
         }), 500
 
+@monetization_bp.route('/affiliate-links/click', methods=['POST'])
+def track_affiliate_click():
+    """Track a click on an affiliate link"""
+    try:
+        from src.main import event_counters
+        
+        data = request.get_json()
+        user_id = data.get('user_id')
+        product_id = data.get('product_id')
+        
+        if not user_id or not product_id:
+            return jsonify({
+                "status": "error",
+                "message": "user_id and product_id are required"
+            }), 400
+        
+        affiliate_clicks = event_counters.get('affiliate_clicks')
+        affiliate_clicks.add(f"{user_id}:{product_id}")
+        
+        return jsonify({
+            "status": "success",
+            "clicks": affiliate_clicks.estimate(f"{user_id}:{product_id}"),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @monetization_bp.route('/withdraw-request', methods=['POST'])
 def request_withdrawal():
     """Request earnings withdrawal"""
@@ -1,14 +1,22 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+import io
 import json
+import re
 from datetime import datetime
+from src.services.records import PRODUCT_FIELDS, ProductView
 
 products_bp = Blueprint('products', __name__)
 
+# Pagination defaults for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
 @products_bp.route('/products')
 def get_all_products():
     """Get all products with optional filtering"""
     try:
-        from src.main import products_db
+        from src.main import catalog
         
         # Get query parameters
         category = request.args.get('category')
@@ -18,26 +26,55 @@ def get_all_products():
         style = request.args.get('style')
         color = request.args.get('color')
         
-        # Filter products
-        filtered_products = products_db.copy()
-        
-        if category:
-            filtered_products = [p for p in filtered_products if p.get('category') == category]
-        if brand:
-            filtered_products = [p for p in filtered_products if p.get('brand') == brand]
-        if min_price:
-            filtered_products = [p for p in filtered_products if p.get('price', 0) >= min_price]
-        if max_price:
-            filtered_products = [p for p in filtered_products if p.get('price', 0) <= max_price]
-        if style:
-            filtered_products = [p for p in filtered_products if p.get('style') == style]
-        if color:
-            filtered_products = [p for p in filtered_products if p.get('color') == color]
+        limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        fields = request.args.get('fields')
+        with_facets = request.args.get('facets', '').lower() in ('1', 'true', 'yes')
         
-        return jsonify({
+        after_id = None
+        if cursor:
+            try:
+                after_id = int(cursor)
+            except ValueError:
+                return jsonify({
+                    "status": "error",
+                    "message": "Invalid cursor"
+                }), 400
+        
+        filters = dict(
+            category=category or None,
+            brand=brand or None,
+            style=style or None,
+            color=color or None,
+            min_price=min_price or None,
+            max_price=max_price or None
+        )
+        
+        # Push filters down to SQL when the catalog is database-backed,
+        # otherwise resolve them through the in-memory indexes; either way
+        # only one page is materialized
+        from src.main import sql_catalog
+        store = sql_catalog if sql_catalog is not None else catalog
+        page_products, total, has_more = store.page(limit, after_id=after_id, **filters)
+        
+        # Sparse field selection; the id is always kept so the cursor can advance
+        if fields:
+            selected = {'id', *(f.strip() for f in fields.split(',') if f.strip())}
+            page_products = [
+                {key: value for key, value in product.items() if key in selected}
+                for product in page_products
+            ]
+        
+        next_cursor = str(page_products[-1]['id']) if has_more else None
+        
+        response = {
             "status": "success",
-            "products": filtered_products,
-            "total": len(filtered_products),
+            "products": page_products,
+            "total": total,
+            "limit": limit,
+            "next_cursor": next_cursor,
+            "has_more": has_more,
             "filters_applied": {
                 "category": category,
                 "brand": brand,
@@ -47,7 +84,13 @@ def get_all_products():
                 "color": color
             },
             "timestamp": datetime.now().isoformat()
-        })
+        }
+        
+        # Facet counts for the current filter set, in one pass over the matches
+        if with_facets:
+            response["facets"] = store.facet_counts(**filters)
+        
+        return jsonify(response)
     
     except Exception as e:
         return jsonify({
@@ -59,10 +102,10 @@ def get_all_products():
 def get_product_details(product_id):
     """Get detailed information about a specific product"""
     try:
-        from src.main import products_db
+        from src.main import catalog, trending
         
         # Find product by ID
-        product = next((p for p in products_db if p['id'] == product_id), None)
+        product = catalog.get(product_id)
         
         if not product:
             return jsonify({
@@ -70,34 +113,37 @@ def get_product_details(product_id):
                 "message": "Product not found"
             }), 404
         
+        # A product page load counts as a view for trending
+        trending.record(product_id, 'view')
+        
         # Add additional details for product page
-        detailed_product = {
-            **product,
-            "features": [
+        detailed_product = ProductView(
+            product,
+            features=[
                 "مصنوع من مواد عالية الجودة",
                 "قابل للغسل في الغسالة",
                 "متوفر بعدة ألوان ومقاسات",
                 "تصميم مقاوم للتجعد",
                 "مناسب لجميع المواسم"
             ],
-            "care_instructions": [
+            care_instructions=[
                 "اغسل بالماء البارد",
                 "لا تستخدم المبيض",
                 "اتركه ليجف في الهواء",
                 "كوي على درجة حرارة منخفضة"
             ],
-            "shipping_info": {
+            shipping_info={
                 "free_shipping": True,
                 "delivery_time": "2-5 أيام عمل",
                 "return_policy": "إرجاع مجاني خلال 30 يوم"
             },
-            "seller_info": {
+            seller_info={
                 "name": f"{product['brand']} Official Store",
                 "rating": 4.8,
                 "total_reviews": 15420,
                 "verified": True
             }
-        }
+        )
         
         return jsonify({
             "status": "success",
@@ -111,61 +157,193 @@ def get_product_details(product_id):
             "message": str(e)
         }), 500
 
+# Fields a patch may change, with the numeric ones validated
+PATCHABLE_NUMBERS = ('price', 'original_price', 'rating', 'discount', 'reviews')
+MAX_DELTAS_PER_REQUEST = 10000
+
+def parse_delta(item, catalog):
+    """Turn one JSON delta into a CatalogStore delta tuple, raising ValueError if invalid"""
+    from src.services.catalog_import import normalize_product
+    
+    if not isinstance(item, dict):
+        raise ValueError("each delta must be an object")
+    op = item.get('op')
+    if op == 'upsert':
+        return ('upsert', normalize_product(item.get('product')))
+    product_id = item.get('id')
+    if not isinstance(product_id, int):
+        raise ValueError(f"{op} delta needs an integer id")
+    if op == 'remove':
+        return ('remove', product_id)
+    if op != 'patch':
+        raise ValueError("op must be one of: upsert, patch, remove")
+    changes = item.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        raise ValueError(f"patch for product {product_id} needs a changes object")
+    if 'id' in changes:
+        raise ValueError("the product id cannot be patched")
+    unknown = sorted(str(field) for field in changes if field not in PRODUCT_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown product fields: {', '.join(unknown)}")
+    for field in PATCHABLE_NUMBERS:
+        value = changes.get(field)
+        if field in changes and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ValueError(f"{field} must be a non-negative number")
+    current = catalog.get(product_id)
+    if current is None:
+        raise LookupError(f"Product {product_id} not found")
+    # Validate the patched product as a whole, as an import would
+    product = normalize_product({**current, **changes})
+    return ('patch', product_id, {field: product[field] for field in changes})
+
+def apply_deltas(deltas):
+    """Apply deltas to the SQL catalog (when configured), then publish them in memory"""
+    from src.main import catalog, catalog_sync, sql_catalog
+    
+    if sql_catalog is None:
+        return catalog.apply(deltas)
+    
+    def publish():
+        try:
+            return catalog.apply(deltas)
+        except KeyError:
+            # This worker has not synced a product the database already
+            # has; copy the committed rows instead
+            return catalog_sync.refresh(delta[1]['id'] if delta[0] == 'upsert' else delta[1] for delta in deltas)
+    
+    return sql_catalog.apply(deltas, after_commit=publish)
+
+@products_bp.route('/products/<int:product_id>', methods=['PATCH'])
+def patch_product(product_id):
+    """Update some fields of a product (e.g. price or discount)"""
+    try:
+        from src.main import catalog
+        
+        try:
+            delta = parse_delta({"op": "patch", "id": product_id, "changes": request.get_json(silent=True)}, catalog)
+        except LookupError:
+            return jsonify({
+                "status": "error",
+                "message": "Product not found"
+            }), 404
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        apply_deltas([delta])
+        
+        return jsonify({
+            "status": "success",
+            "product": catalog.get(product_id),
+            "catalog_version": catalog.version,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@products_bp.route('/products/deltas', methods=['POST'])
+def apply_product_deltas():
+    """Apply a batch of upsert/patch/remove deltas as one catalog version"""
+    try:
+        from src.main import catalog
+        
+        data = request.get_json(silent=True)
+        items = data.get('deltas') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                "status": "error",
+                "message": "deltas must be a non-empty list"
+            }), 400
+        if len(items) > MAX_DELTAS_PER_REQUEST:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {MAX_DELTAS_PER_REQUEST} deltas per request"
+            }), 400
+        
+        try:
+            deltas = [parse_delta(item, catalog) for item in items]
+        except (LookupError, ValueError) as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        try:
+            changed = apply_deltas(deltas)
+        except KeyError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Product {e.args[0]} not found"
+            }), 400
+        
+        return jsonify({
+            "status": "success",
+            "applied": changed,
+            "catalog_version": catalog.version,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @products_bp.route('/products/similar/<int:product_id>')
 def get_similar_products(product_id):
     """Get products similar to the specified product"""
     try:
-        from src.main import products_db
+        from src.main import catalog, neighbor_table, vector_index
         
-        # Find the reference product
-        reference_product = next((p for p in products_db if p['id'] == product_id), None)
+        method = request.args.get('method', 'attributes')
+        nprobe = request.args.get('nprobe', type=int)
         
-        if not reference_product:
+        if catalog.get(product_id) is None:
             return jsonify({
                 "status": "error",
                 "message": "Reference product not found"
             }), 404
         
-        # Find similar products based on category, style, or brand
-        similar_products = []
-        for product in products_db:
-            if product['id'] == product_id:
-                continue
-            
-            similarity_score = 0
-            
-            # Same category
-            if product.get('category') == reference_product.get('category'):
-                similarity_score += 40
-            
-            # Same style
-            if product.get('style') == reference_product.get('style'):
-                similarity_score += 30
-            
-            # Same brand
-            if product.get('brand') == reference_product.get('brand'):
-                similarity_score += 20
-            
-            # Similar price range (within 50% difference)
-            ref_price = reference_product.get('price', 0)
-            prod_price = product.get('price', 0)
-            if ref_price > 0 and abs(prod_price - ref_price) / ref_price <= 0.5:
-                similarity_score += 10
-            
-            if similarity_score >= 30:  # Minimum threshold for similarity
-                similar_products.append({
-                    **product,
-                    "similarity_score": similarity_score
-                })
-        
-        # Sort by similarity score
-        similar_products.sort(key=lambda x: x['similarity_score'], reverse=True)
+        # Embedding neighbours from the ANN index, once it has been trained
+        neighbors = None
+        if method == 'embedding' and vector_index.available:
+            hits = vector_index.search(product_id, k=6, nprobe=nprobe)
+            if hits is not None:
+                neighbors = [
+                    (catalog.get(hit_id), max(0, round(similarity * 100)))
+                    for hit_id, similarity in hits
+                    if catalog.get(hit_id) is not None
+                ]
+                total = len(neighbors)
+        
+        # Otherwise look up the precomputed attribute neighbors
+        if neighbors is None:
+            method = 'attributes'
+            entry = neighbor_table.neighbors(product_id)
+            if entry is None:
+                return jsonify({
+                    "status": "error",
+                    "message": "Reference product not found"
+                }), 404
+            neighbors, total = entry
+        
+        similar_products = [
+            ProductView(product, similarity_score=similarity_score)
+            for product, similarity_score in neighbors
+        ]
         
         return jsonify({
             "status": "success",
             "reference_product_id": product_id,
-            "similar_products": similar_products[:6],  # Return top 6 similar products
-            "total": len(similar_products),
+            "similar_products": similar_products,
+            "total": total,
+            "method": method,
             "timestamp": datetime.now().isoformat()
         })
     
@@ -179,28 +357,45 @@ def get_similar_products(product_id):
 def get_trending_products():
     """Get trending/popular products"""
     try:
-        from src.main import products_db
-        import random
+        from src.main import catalog, trending
+        from src.services.trending import trending_reason, trending_scores
+        
+        limit = max(1, min(request.args.get('limit', 20, type=int), trending.top_k))
+        
+        # Read the maintained top-k of time-decayed engagement
+        ranking = [
+            (product_id, score) for product_id, score in trending.top(limit)
+            if catalog.get(product_id) is not None
+        ]
+        scores = trending_scores(ranking)
         
-        # Add trending metrics to products
         trending_products = []
-        for product in products_db:
-            trending_product = {
-                **product,
-                "trending_score": random.randint(70, 100),
-                "views_today": random.randint(500, 2000),
-                "purchases_today": random.randint(10, 50),
-                "trending_reason": random.choice([
-                    "الأكثر مبيعاً اليوم",
-                    "ترند جديد في الموضة",
-                    "مفضل المشاهير",
-                    "عرض محدود الوقت"
-                ])
-            }
-            trending_products.append(trending_product)
+        for (product_id, _), trending_score in zip(ranking, scores):
+            product = catalog.get(product_id)
+            purchases_today = trending.today(product_id, 'purchase')
+            trending_products.append(ProductView(
+                product,
+                trending_score=trending_score,
+                views_today=trending.today(product_id, 'view'),
+                purchases_today=purchases_today,
+                trending_reason=trending_reason(product, purchases_today)
+            ))
         
-        # Sort by trending score
-        trending_products.sort(key=lambda x: x['trending_score'], reverse=True)
+        # Not enough traffic yet: fill up with catalog products
+        if len(trending_products) < limit:
+            seen = {product_id for product_id, _ in ranking}
+            for product in catalog.head(limit + len(seen)):
+                if len(trending_products) >= limit:
+                    break
+                if product['id'] in seen:
+                    continue
+                trending_products.append(ProductView(
+                    product,
+                    trending_score=0,
+                    views_today=0,
+                    purchases_today=0,
+                    trending_reason=trending_reason(product, 0)
+                ))
         
         return jsonify({
             "status": "success",
@@ -215,19 +410,151 @@ def get_trending_products():
             "message": str(e)
         }), 500
 
+# Most trending events accepted in one request
+MAX_EVENTS_PER_REQUEST = 1000
+
+def parse_event(event):
+    """Check one JSON trending event, raising ValueError if invalid"""
+    from src.services.trending import EVENT_WEIGHTS
+    
+    if not isinstance(event, dict):
+        raise ValueError("each event must be an object")
+    product_id = event.get('product_id')
+    if isinstance(product_id, bool) or not isinstance(product_id, int):
+        raise ValueError("product_id must be an integer")
+    if event.get('event_type') not in EVENT_WEIGHTS:
+        raise ValueError(f"event_type must be one of: {', '.join(EVENT_WEIGHTS)}")
+    count = event.get('count', 1)
+    if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+        raise ValueError("count must be a positive integer")
+    region = event.get('region')
+    if region is not None and not isinstance(region, str):
+        raise ValueError("region must be a string")
+    return product_id, event['event_type'], count, region
+
+@products_bp.route('/products/events', methods=['POST'])
+def record_product_events():
+    """Record view/click/purchase events for trending"""
+    try:
+        from src.main import catalog, trending
+        
+        # A body is either one event or {"events": [...]}
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                "status": "error",
+                "message": "Request body must be a JSON object"
+            }), 400
+        events = data.get('events', [data])
+        if not isinstance(events, list) or not events:
+            return jsonify({
+                "status": "error",
+                "message": "events must be a non-empty list"
+            }), 400
+        if len(events) > MAX_EVENTS_PER_REQUEST:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {MAX_EVENTS_PER_REQUEST} events per request"
+            }), 400
+        
+        # Validate the whole batch before recording any of it
+        try:
+            parsed = [parse_event(event) for event in events]
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        
+        accepted = 0
+        for product_id, event_type, count, region in parsed:
+            if catalog.get(product_id) is None:
+                continue
+            trending.record(product_id, event_type, count, region=region)
+            accepted += 1
+        
+        return jsonify({
+            "status": "success",
+            "accepted": accepted,
+            "rejected": len(parsed) - accepted,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@products_bp.route('/products/import', methods=['POST'])
+def import_products():
+    """Stream a JSONL or CSV product feed into the catalog"""
+    try:
+        from src.main import catalog, sql_catalog
+        from src.services.catalog_import import import_feed, iter_feed
+        
+        fmt = request.args.get('format')
+        if fmt is None:
+            fmt = 'csv' if request.mimetype == 'text/csv' else 'jsonl'
+        if fmt not in ('csv', 'jsonl'):
+            return jsonify({
+                "status": "error",
+                "message": "format must be csv or jsonl"
+            }), 400
+        try:
+            batch_size = min(max(int(request.args.get('batch_size', 5000)), 1), 50000)
+        except ValueError:
+            return jsonify({
+                "status": "error",
+                "message": "batch_size must be an integer"
+            }), 400
+        
+        # Parse the body as it arrives instead of buffering the whole feed
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        stats = import_feed(iter_feed(stream, fmt), catalog, sql_catalog=sql_catalog, batch_size=batch_size)
+        
+        return jsonify({
+            "status": "success",
+            **stats,
+            "catalog_size": len(catalog),
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except RequestEntityTooLarge:
+        return jsonify({
+            "status": "error",
+            "message": f"Feeds are limited to {current_app.config['MAX_IMPORT_LENGTH']} bytes"
+        }), 413
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+# Public categories as (id, name, catalog field, catalog values counted);
+# the last three group products by style rather than category
+PRODUCT_CATEGORIES = (
+    ("dress", "فساتين", 'category', ("فستان", "فساتين")),
+    ("suit", "بدل", 'category', ("بدلة", "بدل")),
+    ("shoes", "أحذية", 'category', ("حذاء", "أحذية")),
+    ("bags", "حقائب", 'category', ("حقيبة", "حقائب")),
+    ("accessories", "إكسسوارات", 'category', ("إكسسوار", "إكسسوارات")),
+    ("casual", "ملابس كاجوال", 'style', ("كاجوال", "casual")),
+    ("formal", "ملابس رسمية", 'style', ("رسمي", "formal")),
+    ("sportswear", "ملابس رياضية", 'style', ("رياضي", "sportswear"))
+)
+
 @products_bp.route('/products/categories')
 def get_product_categories():
     """Get all available product categories"""
     try:
+        from src.main import catalog
+        
+        # Ids and names stay fixed; counts come from the catalog's indexes
+        facets = catalog.facet_counts()
         categories = [
-            {"id": "dress", "name": "فساتين", "count": 150},
-            {"id": "suit", "name": "بدل", "count": 89},
-            {"id": "shoes", "name": "أحذية", "count": 234},
-            {"id": "bags", "name": "حقائب", "count": 67},
-            {"id": "accessories", "name": "إكسسوارات", "count": 123},
-            {"id": "casual", "name": "ملابس كاجوال", "count": 198},
-            {"id": "formal", "name": "ملابس رسمية", "count": 76},
-            {"id": "sportswear", "name": "ملابس رياضية", "count": 145}
+            {"id": category_id, "name": name, "count": sum(facets[field].get(value, 0) for value in values)}
+            for category_id, name, field, values in PRODUCT_CATEGORIES
         ]
         
         return jsonify({
@@ -247,15 +574,13 @@ def get_product_categories():
 def get_product_brands():
     """Get all available brands"""
     try:
+        from src.main import catalog
+        
+        # Counts come straight from the catalog's brand index
+        counts = catalog.facet_counts()['brand']
         brands = [
-            {"id": "zara", "name": "Zara", "count": 45},
-            {"id": "hm", "name": "H&M", "count": 38},
-            {"id": "nike", "name": "Nike", "count": 67},
-            {"id": "adidas", "name": "Adidas", "count": 52},
-            {"id": "hugo-boss", "name": "Hugo Boss", "count": 23},
-            {"id": "gucci", "name": "Gucci", "count": 15},
-            {"id": "prada", "name": "Prada", "count": 12},
-            {"id": "versace", "name": "Versace", "count": 8}
+            {"id": slugify(name), "name": name, "count": count}
+            for name, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
         ]
         
         return jsonify({
@@ -271,3 +596,7 @@ def get_product_brands():
             "message": str(e)
         }), 500
 
+def slugify(name):
+    """Turn a display name into a URL-friendly id (e.g. "Hugo Boss" -> "hugo-boss")"""
+    slug = re.sub(r'[^\w]+', '-', name.lower(), flags=re.UNICODE).strip('-')
+    return slug or name
@@ -1,62 +1,217 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, url_for
 import json
 import base64
+import binascii
 import io
+import time
+import uuid
 from datetime import datetime
-import random
+from werkzeug.exceptions import RequestEntityTooLarge
+from src.services.blob_store import BlobTooLarge
+from src.services.event_broker import TERMINAL_EVENTS
+from src.services.json_encoding import encode
+from src.services.tryon_jobs import PRIORITIES, QueueFull
 
 virtual_bp = Blueprint('virtual_tryons', __name__)
 
 # Mock storage for virtual try-on sessions
 virtual_sessions = {}
 
+# Request body allowance on top of a photo's bytes for multipart framing,
+# form fields and JSON; base64 photos also grow by a third
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+# Server push: longest status?wait=, SSE keep-alive comment interval, the
+# lifetime of one SSE connection and the reconnect delay sent to clients.
+# Both hold a worker thread, so they stay short and clients reconnect
+LONG_POLL_MAX_SECONDS = 20
+SSE_KEEPALIVE_SECONDS = 10
+SSE_MAX_SECONDS = 25
+SSE_RETRY_MS = 1000
+
+def on_tryon_job_update(session_id, event, changes):
+    """Try-on job listener; applies job progress and results to the session"""
+    session = virtual_sessions.get(session_id)
+    if session is not None:
+        session.update(changes)
+
+@virtual_bp.route('/virtual-tryon/upload', methods=['POST'])
+def upload_tryon_image():
+    """Upload a photo for virtual try-on (multipart field `image`, or the raw image as the body)"""
+    try:
+        from src.main import tryon_images
+        
+        upload = request.files.get('image')
+        stream = upload.stream if upload is not None else request.stream
+        image = store_tryon_image(tryon_images, stream=stream)
+        
+        return jsonify({
+            "status": "success",
+            **image,
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    except (BlobTooLarge, RequestEntityTooLarge):
+        return jsonify({
+            "status": "error",
+            "message": f"Images are limited to {tryon_images.max_bytes} bytes"
+        }), 413
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @virtual_bp.route('/virtual-tryon/create', methods=['POST'])
 def create_virtual_tryon():
-    """Create a new virtual try-on session"""
+    """Create a new virtual try-on session
+    
+    The photo is a `user_image_id` from /virtual-tryon/upload, a
+    `user_image` file in a multipart request, or (legacy) a base64
+    `user_image` string in JSON, which is decoded and stored.
+    """
     try:
-        data = request.get_json()
+        from src.main import tryon_images, tryon_jobs
+        
+        if request.mimetype == 'multipart/form-data':
+            data = request.form
+            product_id = data.get('product_id', type=int)
+            upload = request.files.get('user_image')
+        else:
+            data = request.get_json()
+            product_id = data.get('product_id')
+            upload = None
         user_id = data.get('user_id')
-        product_id = data.get('product_id')
-        user_image = data.get('user_image')  # Base64 encoded image
+        user_image = data.get('user_image')  # Legacy base64 encoded image
+        user_image_id = data.get('user_image_id')
+        priority = data.get('priority', 'normal')
+        
+        if not all([user_id, product_id, upload or user_image or user_image_id]):
+            return jsonify({
+                "status": "error",
+                "message": "user_id, product_id, and user_image or user_image_id are required"
+            }), 400
+        
+        if priority not in PRIORITIES:
+            return jsonify({
+                "status": "error",
+                "message": f"priority must be one of: {', '.join(PRIORITIES)}"
+            }), 400
         
-        if not all([user_id, product_id, user_image]):
+        # Keep only a reference to the photo; the bytes live in the blob store
+        try:
+            if upload is not None:
+                user_image_id = store_tryon_image(tryon_images, stream=upload.stream)['image_id']
+            elif user_image:
+                user_image_id = store_tryon_image(tryon_images, data=decode_base64_image(user_image))['image_id']
+            elif not tryon_images.touch(user_image_id):
+                raise ValueError("Unknown user_image_id")
+        except BlobTooLarge as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 413
+        except ValueError as e:
             return jsonify({
                 "status": "error",
-                "message": "user_id, product_id, and user_image are required"
+                "message": str(e)
             }), 400
         
         # Generate session ID
-        session_id = f"vto_{user_id}_{product_id}_{int(datetime.now().timestamp())}"
+        session_id = f"vto_{user_id}_{product_id}_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:6]}"
         
-        # Store session data
+        # Store session data; the job queue fills in progress and the result
         virtual_sessions[session_id] = {
             "session_id": session_id,
             "user_id": user_id,
             "product_id": product_id,
-            "user_image": user_image,
-            "status": "processing",
+            "user_image_id": user_image_id,
+            "user_image_url": url_for('virtual_tryons.get_tryon_image', image_id=user_image_id),
+            "status": "queued",
             "created_at": datetime.now().isoformat(),
             "progress": 0
         }
         
+        try:
+            queue_position = tryon_jobs.submit(session_id, {
+                "session_id": session_id,
+                "user_id": user_id,
+                "product_id": product_id,
+                "user_image_id": user_image_id,
+                "user_image_path": tryon_images.path(user_image_id)
+            }, priority=priority)
+        except QueueFull as e:
+            virtual_sessions.pop(session_id, None)
+            response = jsonify({
+                "status": "error",
+                "message": "Virtual try-on is busy, please retry later",
+                "user_image_id": user_image_id,
+                "queue_position": e.queued + 1,
+                "retry_after": e.retry_after,
+                "timestamp": datetime.now().isoformat()
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+        
         return jsonify({
             "status": "success",
             "session_id": session_id,
             "message": "Virtual try-on session created successfully",
-            "estimated_time": "30-60 seconds",
+            "user_image_id": user_image_id,
+            "queue_position": queue_position,
+            "estimated_time": f"{tryon_jobs.wait_seconds(queue_position)} seconds",
             "timestamp": datetime.now().isoformat()
         })
     
+    except RequestEntityTooLarge:
+        return jsonify({
+            "status": "error",
+            "message": f"Images are limited to {tryon_images.max_bytes} bytes"
+        }), 413
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
 
+@virtual_bp.route('/virtual-tryon/images/<image_id>')
+def get_tryon_image(image_id):
+    """Serve an uploaded try-on photo by its content hash"""
+    from src.main import tryon_images
+    
+    if not tryon_images.exists(image_id):
+        return jsonify({
+            "status": "error",
+            "message": "Image not found"
+        }), 404
+    
+    # Content-addressed, so the bytes behind an id never change
+    return send_file(
+        tryon_images.path(image_id),
+        mimetype=tryon_images.content_type(image_id) or 'application/octet-stream',
+        etag=image_id,
+        max_age=365 * 24 * 3600,
+        conditional=True
+    )
+
 @virtual_bp.route('/virtual-tryon/status/<session_id>')
 def get_tryon_status(session_id):
-    """Get the status of a virtual try-on session"""
+    """Get the status of a virtual try-on session
+    
+    Long-poll with ``?wait=<seconds>&since=<event_id>``: the response is
+    held until the session changes after `since` (the `event_id` of the
+    previous response) or `wait` seconds (at most LONG_POLL_MAX_SECONDS) pass.
+    """
     try:
+        from src.main import tryon_events
+        
+        # Read the event id first, so the session is at least that fresh
+        event_id = tryon_events.last_id(session_id)
         session = virtual_sessions.get(session_id)
         
         if not session:
@@ -65,42 +220,16 @@ def get_tryon_status(session_id):
                 "message": "Session not found"
             }), 404
         
-        # Simulate processing progress
-        if session['status'] == 'processing':
-            # Simulate progress based on time elapsed
-            created_time = datetime.fromisoformat(session['created_at'])
-            elapsed_seconds = (datetime.now() - created_time).total_seconds()
-            
-            if elapsed_seconds < 10:
-                session['progress'] = min(30, elapsed_seconds * 3)
-                session['current_step'] = "تحليل الصورة الشخصية..."
-            elif elapsed_seconds < 20:
-                session['progress'] = min(60, 30 + (elapsed_seconds - 10) * 3)
-                session['current_step'] = "تحليل المنتج وخصائصه..."
-            elif elapsed_seconds < 30:
-                session['progress'] = min(90, 60 + (elapsed_seconds - 20) * 3)
-                session['current_step'] = "تطبيق المنتج على الصورة..."
-            else:
-                session['progress'] = 100
-                session['status'] = 'completed'
-                session['current_step'] = "تم الانتهاء!"
-                
-                # Generate mock result
-                session['result'] = {
-                    "result_image": "https://images.unsplash.com/photo-1515372039744-b8f02a3ae446?w=400&h=600&fit=crop",
-                    "confidence_score": random.randint(85, 98),
-                    "ai_feedback": generate_ai_feedback(session['product_id']),
-                    "fit_analysis": {
-                        "overall_fit": "ممتاز",
-                        "color_match": "مناسب جداً",
-                        "style_compatibility": "متوافق مع أسلوبك",
-                        "size_recommendation": "المقاس M مناسب لك"
-                    }
-                }
+        wait = min(request.args.get('wait', 0, type=float), LONG_POLL_MAX_SECONDS)
+        since = request.args.get('since', type=int)
+        if wait > 0 and since is not None and event_id <= since and session['status'] not in TERMINAL_EVENTS:
+            events = tryon_events.wait(session_id, since=since, timeout=wait)
+            event_id = events[-1][0] if events else since
         
         return jsonify({
             "status": "success",
-            "session": session,
+            "session": session_state(session_id),
+            "event_id": event_id,
             "timestamp": datetime.now().isoformat()
         })
     
@@ -110,6 +239,51 @@ def get_tryon_status(session_id):
             "message": str(e)
         }), 500
 
+@virtual_bp.route('/virtual-tryon/events/<session_id>')
+def stream_tryon_events(session_id):
+    """Stream a try-on session's progress as Server-Sent Events
+    
+    The stream opens with a `status` event carrying the whole session,
+    then relays the job's queued/started/progress events and closes after
+    `completed` or `failed`. A reconnecting client gets a fresh `status`
+    event, so nothing published in between is lost.
+    """
+    from src.main import tryon_events
+    
+    if session_id not in virtual_sessions:
+        return jsonify({
+            "status": "error",
+            "message": "Session not found"
+        }), 404
+    
+    def generate():
+        last_id = tryon_events.last_id(session_id)
+        session = session_state(session_id)
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        yield sse_message('status', session, last_id)
+        if session is None or session['status'] in TERMINAL_EVENTS:
+            return
+        
+        deadline = time.monotonic() + SSE_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = tryon_events.wait(session_id, since=last_id, timeout=min(SSE_KEEPALIVE_SECONDS, remaining))
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event_id, event, data in events:
+                yield sse_message(event, data, event_id)
+                last_id = event_id
+                if event in TERMINAL_EVENTS:
+                    return
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 @virtual_bp.route('/virtual-tryon/result/<session_id>')
 def get_tryon_result(session_id):
     """Get the final result of a virtual try-on session"""
@@ -222,25 +396,58 @@ def get_user_tryon_history(user_id):
             "message": str(e)
         }), 500
 
-def generate_ai_feedback(product_id):
-    """Generate AI feedback for virtual try-on result"""
-    feedback_options = [
-        {
-            "overall": "هذا المنتج يبدو رائعاً عليك! اللون يتماشى بشكل مثالي مع لون بشرتك.",
-            "pros": ["اللون مناسب جداً", "القصة تبرز نقاط القوة في جسمك", "الأسلوب يتماشى مع شخصيتك"],
-            "suggestions": ["يمكنك إضافة إكسسوارات ذهبية لإطلالة أكثر أناقة", "حذاء بكعب متوسط سيكمل الإطلالة"]
-        },
-        {
-            "overall": "خيار جيد! هذا المنتج مناسب لك ولكن يمكن تحسين الإطلالة ببعض التعديلات.",
-            "pros": ["المقاس مناسب", "الجودة تبدو عالية", "مناسب للمناسبات المختلفة"],
-            "suggestions": ["جرب لون أفتح للحصول على إطلالة أكثر إشراقاً", "أضف حزام لإبراز الخصر"]
-        },
-        {
-            "overall": "إطلالة مميزة! هذا المنتج يناسب أسلوبك الشخصي بشكل كبير.",
-            "pros": ["يبرز شخصيتك المميزة", "مريح وعملي", "يناسب عدة مناسبات"],
-            "suggestions": ["اختر إكسسوارات بسيطة لتوازن الإطلالة", "يمكن تنسيقه مع قطع أخرى بسهولة"]
-        }
-    ]
+def decode_base64_image(user_image):
+    """Decode a legacy base64 (or data: URL) image string"""
+    if user_image.startswith('data:'):
+        user_image = user_image.partition(',')[2]
+    try:
+        return base64.b64decode(user_image, validate=True)
+    except binascii.Error:
+        raise ValueError("user_image is not valid base64")
+
+def upload_size_limit(blob_store):
+    """Return the largest request body accepted by the photo upload routes"""
+    if blob_store.max_bytes is None:
+        return None
+    return blob_store.max_bytes * 4 // 3 + UPLOAD_OVERHEAD_BYTES
+
+def referenced_image_ids():
+    """Return the ids of the photos live sessions still point to"""
+    return {session.get('user_image_id') for session in list(virtual_sessions.values())}
+
+def store_tryon_image(blob_store, stream=None, data=None):
+    """Store an uploaded photo in the blob store and describe it
     
-    return random.choice(feedback_options)
+    Raises ValueError unless it is a JPEG, PNG, GIF or WebP image.
+    """
+    if stream is not None:
+        image_id, size = blob_store.put_stream(stream)
+    else:
+        image_id, size = blob_store.put_bytes(data)
+    content_type = blob_store.content_type(image_id)
+    if content_type is None:
+        blob_store.delete(image_id)
+        raise ValueError("Unsupported image type; upload a JPEG, PNG, GIF or WebP image")
+    return {
+        "image_id": image_id,
+        "size": size,
+        "content_type": content_type,
+        "url": url_for('virtual_tryons.get_tryon_image', image_id=image_id)
+    }
+
+def session_state(session_id):
+    """Return a copy of a session with its live queue position, or None"""
+    session = virtual_sessions.get(session_id)
+    if session is None:
+        return None
+    session = dict(session)  # job updates keep arriving while it is encoded
+    if session['status'] == 'queued':
+        from src.main import tryon_jobs
+        queue_position = tryon_jobs.position(session_id)
+        if queue_position is not None:
+            session['queue_position'] = queue_position
+    return session
 
+def sse_message(event, data, event_id):
+    """Format one Server-Sent Events message"""
+    return f"id: {event_id}\nevent: {event}\ndata: {encode(data).decode('utf-8')}\n\n"
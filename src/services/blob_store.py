@@ -0,0 +1,170 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+# Bytes read per chunk when streaming uploads to disk
+CHUNK_SIZE = 64 * 1024
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+# Leading bytes of the image types accepted for try-on, as (prefix, offset, mimetype)
+_IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 0, 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 0, 'image/png'),
+    (b'GIF87a', 0, 'image/gif'),
+    (b'GIF89a', 0, 'image/gif'),
+    (b'WEBP', 8, 'image/webp'),
+)
+
+
+class BlobTooLarge(ValueError):
+    """Raised when a blob exceeds the store's `max_bytes`"""
+
+
+def sniff_image_type(header):
+    """Return the mimetype of an image from its first bytes, or None"""
+    for prefix, offset, mimetype in _IMAGE_SIGNATURES:
+        if header[offset:offset + len(prefix)] == prefix:
+            return mimetype
+    return None
+
+
+class BlobStore:
+    """Content-addressed blob files on disk
+
+    A blob is stored once under its SHA-256 hex digest (fanned out as
+    ``ab/abcdef...``), so identical uploads share one file. Writes stream
+    through a temporary file in the store and are moved into place with
+    os.replace, so readers never see a partial blob. Blobs are immutable;
+    the digest is their id.
+
+    The store directory is private to the app's user (mode 0700). A blob's
+    mtime is refreshed whenever it is stored again or referenced, and
+    `prune` deletes blobs left untouched for longer than a retention age.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._prune_thread = None
+        os.makedirs(os.path.join(root, 'tmp'), mode=0o700, exist_ok=True)
+        os.chmod(root, 0o700)
+
+    def path(self, digest):
+        """Return the file path of a blob; raises ValueError for a malformed id"""
+        if not isinstance(digest, str) or not _DIGEST.match(digest):
+            raise ValueError("Invalid blob id")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        try:
+            return os.path.exists(self.path(digest))
+        except ValueError:
+            return False
+
+    def put_stream(self, stream):
+        """Store a binary stream read in chunks; returns ``(digest, size)``
+
+        Raises BlobTooLarge once more than `max_bytes` have been read.
+        """
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if self.max_bytes is not None and size > self.max_bytes:
+                        raise BlobTooLarge(f"Blob exceeds {self.max_bytes} bytes")
+                    sha256.update(chunk)
+                    f.write(chunk)
+            digest = sha256.hexdigest()
+            path = self.path(digest)
+            if self.touch(digest):
+                os.unlink(tmp_path)  # already stored
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, size
+
+    def put_bytes(self, data):
+        """Store bytes; returns ``(digest, size)``"""
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            raise BlobTooLarge(f"Blob exceeds {self.max_bytes} bytes")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not self.touch(digest):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest, len(data)
+
+    def content_type(self, digest):
+        """Return the sniffed image mimetype of a stored blob, or None"""
+        with open(self.path(digest), 'rb') as f:
+            return sniff_image_type(f.read(16))
+
+    def touch(self, digest):
+        """Mark a blob as recently used; returns False if it does not exist"""
+        try:
+            os.utime(self.path(digest))
+        except (FileNotFoundError, ValueError):
+            return False
+        return True
+
+    def delete(self, digest):
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, max_age, keep=()):
+        """Delete blobs untouched for `max_age` seconds unless their id is in `keep`
+
+        Abandoned temporary files of the same age go too. Returns the
+        number of files deleted.
+        """
+        cutoff = time.time() - max_age
+        deleted = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            for blob in os.scandir(entry.path):
+                if entry.name != 'tmp' and blob.name in keep:
+                    continue
+                try:
+                    if blob.stat(follow_symlinks=False).st_mtime < cutoff:
+                        os.unlink(blob.path)
+                        deleted += 1
+                except FileNotFoundError:
+                    pass  # deleted or replaced concurrently
+        return deleted
+
+    def start_pruning(self, max_age, interval=3600, keep=None):
+        """Run `prune` every `interval` seconds in a background thread
+
+        `keep` is a callable returning the ids still referenced.
+        """
+        def run():
+            while True:
+                try:
+                    self.prune(max_age, keep=keep() if keep else ())
+                except OSError:
+                    pass  # try again next round
+                time.sleep(interval)
+
+        if self._prune_thread is None:
+            self._prune_thread = threading.Thread(target=run, name='blob-prune', daemon=True)
+            self._prune_thread.start()
@@ -0,0 +1,538 @@
+from bisect import bisect_left, bisect_right, insort
+import heapq
+from itertools import chain, islice
+import threading
+
+from src.services.records import ProductRecord
+
+# Fields that get an equality (posting set) index
+INDEXED_FIELDS = ('category', 'brand', 'style', 'color')
+
+# Number of id -> product dicts; a write copies only the shards it touches
+SHARD_COUNT = 1024
+
+# Entries per block of the sorted id/price indexes
+BLOCK_SIZE = 1024
+
+
+class SortedBlocks:
+    """Immutable sorted sequence stored as a list of sorted blocks
+
+    `updated` returns a new sequence that shares every block it did not
+    touch, so a write costs O(changes * BLOCK_SIZE + len / BLOCK_SIZE)
+    instead of copying the whole sequence.
+    """
+
+    __slots__ = ('_blocks', '_maxes', '_len')
+
+    def __init__(self, blocks=()):
+        self._blocks = [block for block in blocks if block]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = sum(len(block) for block in self._blocks)
+
+    @classmethod
+    def from_sorted(cls, items):
+        return cls(items[i:i + BLOCK_SIZE] for i in range(0, len(items), BLOCK_SIZE))
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._blocks)
+
+    def irange(self, lo=None, hi=None, lo_inclusive=True):
+        """Iterate the entries between `lo` and `hi` (inclusive) in order"""
+        blocks, maxes = self._blocks, self._maxes
+        if lo is None:
+            index, pos = 0, 0
+        else:
+            find = bisect_left if lo_inclusive else bisect_right
+            index = find(maxes, lo)
+            if index == len(blocks):
+                return
+            pos = find(blocks[index], lo)
+        for block in islice(blocks, index, None):
+            for entry in islice(block, pos, None):
+                if hi is not None and entry > hi:
+                    return
+                yield entry
+            pos = 0
+
+    def updated(self, removed=(), added=()):
+        """Return a new sequence without `removed` and with `added`"""
+        blocks = list(self._blocks)
+        maxes = self._maxes
+        copied = set()
+
+        def writable(index):
+            if index not in copied:
+                blocks[index] = list(blocks[index])
+                copied.add(index)
+            return blocks[index]
+
+        for entry in removed:
+            index = bisect_left(maxes, entry)
+            if index < len(blocks):
+                block = blocks[index]
+                pos = bisect_left(block, entry)
+                if pos < len(block) and block[pos] == entry:
+                    del writable(index)[pos]
+        # Stale maxes are still valid upper bounds, so they place additions correctly
+        for entry in added:
+            if not blocks:
+                blocks.append([])
+                copied.add(0)
+            index = min(bisect_left(maxes, entry), len(blocks) - 1)
+            insort(writable(index), entry)
+        result = []
+        for index, block in enumerate(blocks):
+            if index in copied and len(block) > 2 * BLOCK_SIZE:
+                result.extend(block[i:i + BLOCK_SIZE] for i in range(0, len(block), BLOCK_SIZE))
+            else:
+                result.append(block)
+        return SortedBlocks(result)
+
+
+class CatalogQueries:
+    """Filter, pagination and facet queries shared by catalog snapshots
+
+    Subclasses provide `get`, `posting`, `ids_in_price_range`, `__len__`
+    and the `_price`, `_all_ids`, `_ids_after` and `_posting_sizes`
+    primitives.
+    """
+
+    __slots__ = ()
+
+    def _candidates(self, min_price=None, max_price=None, within=None, **equals):
+        """Return the (unordered) ids matching the filters, or None for "all"
+
+        Equality filters (category, brand, style, color) are resolved by
+        intersecting posting sets smallest-first; the price range is applied
+        by bisecting the price index, or by checking the few remaining
+        candidates when an equality filter already narrowed the set.
+        `within` is an optional set of ids (e.g. text search hits) treated
+        as one more posting set.
+        """
+        postings = [] if within is None else [within]
+        for field, value in equals.items():
+            if value is None:
+                continue
+            if field not in INDEXED_FIELDS:
+                raise ValueError(f"Unsupported filter field: {field}")
+            postings.append(self.posting(field, value))
+
+        if postings:
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates &= posting
+            if min_price is not None or max_price is not None:
+                candidates = {
+                    product_id for product_id in candidates
+                    if _in_range(self._price(product_id), min_price, max_price)
+                }
+            return candidates
+        if min_price is not None or max_price is not None:
+            return self.ids_in_price_range(min_price, max_price)
+        return None
+
+    def filter_ids(self, min_price=None, max_price=None, within=None, **equals):
+        """Return the sorted ids matching all equality filters and the price range"""
+        candidates = self._candidates(min_price=min_price, max_price=max_price, within=within, **equals)
+        if candidates is None:
+            return list(self._all_ids())
+        return sorted(candidates)
+
+    def filter(self, min_price=None, max_price=None, within=None, **equals):
+        """Return the products matching the filters, ordered by id"""
+        ids = self.filter_ids(min_price=min_price, max_price=max_price, within=within, **equals)
+        return [self.get(product_id) for product_id in ids]
+
+    def count(self, min_price=None, max_price=None, **equals):
+        """Return the number of products matching the filters"""
+        candidates = self._candidates(min_price=min_price, max_price=max_price, **equals)
+        return len(self) if candidates is None else len(candidates)
+
+    def page(self, limit, after_id=None, min_price=None, max_price=None, **equals):
+        """Return one keyset page of matching products ordered by id
+
+        Returns ``(products, total, has_more)``. Only the products on the
+        page are materialized; the total is the size of the candidate set.
+        """
+        candidates = self._candidates(min_price=min_price, max_price=max_price, **equals)
+        if candidates is None:
+            total = len(self)
+            ids = list(islice(self._ids_after(after_id), limit + 1))
+        else:
+            total = len(candidates)
+            if after_id is not None:
+                candidates = (i for i in candidates if i > after_id)
+            ids = heapq.nsmallest(limit + 1, candidates)
+        has_more = len(ids) > limit
+        return [self.get(i) for i in ids[:limit]], total, has_more
+
+    def facet_counts(self, min_price=None, max_price=None, within=None, **equals):
+        """Return ``{field: {value: count}}`` over the products matching the filters
+
+        Without filters the counts are the posting set sizes, which the
+        indexes keep current on every insert/update/delete. With filters
+        the matching ids are counted in a single pass.
+        """
+        candidates = self._candidates(min_price=min_price, max_price=max_price, within=within, **equals)
+        if candidates is None:
+            return {field: self._posting_sizes(field) for field in INDEXED_FIELDS}
+        counts = {field: {} for field in INDEXED_FIELDS}
+        for product_id in candidates:
+            product = self.get(product_id)
+            for field in INDEXED_FIELDS:
+                value = product.get(field)
+                if value is not None:
+                    field_counts = counts[field]
+                    field_counts[value] = field_counts.get(value, 0) + 1
+        return counts
+
+
+class CatalogSnapshot(CatalogQueries):
+    """One immutable version of the catalog and its indexes
+
+    Snapshots are never modified after they are published, so a reader
+    holding one sees a consistent catalog without taking any lock, however
+    many writes happen meanwhile. Products are ordered by id.
+    """
+
+    __slots__ = ('version', '_shards', '_postings', '_price_index', '_ids')
+
+    def __init__(self, version, shards, postings, price_index, ids):
+        self.version = version
+        self._shards = shards  # tuple of SHARD_COUNT {id: product} dicts
+        self._postings = postings  # field -> {value: frozenset of ids}
+        self._price_index = price_index  # SortedBlocks of (price, id)
+        self._ids = ids  # SortedBlocks of ids, for keyset pagination
+
+    @classmethod
+    def build(cls, version, products):
+        shards = tuple({} for _ in range(SHARD_COUNT))
+        for product in products:
+            product = ProductRecord.of(product)
+            shards[hash(product['id']) % SHARD_COUNT][product['id']] = product
+        postings = {field: {} for field in INDEXED_FIELDS}
+        price_index = []
+        ids = []
+        for shard in shards:
+            for product_id, product in shard.items():
+                ids.append(product_id)
+                price_index.append((product.get('price', 0), product_id))
+                for field in INDEXED_FIELDS:
+                    value = product.get(field)
+                    if value is not None:
+                        postings[field].setdefault(value, set()).add(product_id)
+        postings = {
+            field: {value: frozenset(posting) for value, posting in values.items()}
+            for field, values in postings.items()
+        }
+        price_index.sort()
+        ids.sort()
+        return cls(version, shards, postings, SortedBlocks.from_sorted(price_index), SortedBlocks.from_sorted(ids))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self.products())
+
+    def get(self, product_id):
+        """Return a product by id in O(1), or None"""
+        return self._shards[hash(product_id) % SHARD_COUNT].get(product_id)
+
+    def products(self):
+        """Return all products ordered by id"""
+        return [self.get(product_id) for product_id in self._ids]
+
+    def head(self, n):
+        """Return the first `n` products without copying the whole catalog"""
+        return [self.get(product_id) for product_id in islice(self._ids, n)]
+
+    def posting(self, field, value):
+        """Return the set of ids whose `field` equals `value`"""
+        return self._postings[field].get(value, frozenset())
+
+    def ids_in_price_range(self, min_price=None, max_price=None):
+        """Return the ids whose price falls in [min_price, max_price]"""
+        lo = None if min_price is None else (min_price,)
+        hi = None if max_price is None else (max_price, float('inf'))
+        return {product_id for _, product_id in self._price_index.irange(lo, hi)}
+
+    def _price(self, product_id):
+        return self.get(product_id).get('price', 0)
+
+    def _all_ids(self):
+        return self._ids
+
+    def _ids_after(self, after_id):
+        return self._ids.irange(after_id, lo_inclusive=False)
+
+    def _posting_sizes(self, field):
+        return {value: len(ids) for value, ids in self._postings[field].items()}
+
+
+class CatalogStore:
+    """Versioned in-memory product catalog with an id index and secondary indexes
+
+    The current state is an immutable CatalogSnapshot. Writers apply a
+    batch of deltas under a lock, copying only the id shards, posting sets
+    and sorted indexes the batch touches, then publish the new snapshot
+    with a single reference assignment. Readers never block: they either
+    call the read methods below (each runs against one snapshot) or take
+    `snapshot()` to make several consistent reads. Products are stored as
+    read-only ProductRecords; a patch replaces the record.
+    """
+
+    def __init__(self, products=None):
+        self._lock = threading.RLock()  # serializes writers only
+        self._snapshot = CatalogSnapshot.build(0, [])
+        self._listeners = []
+        if products:
+            self.load(products)
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def snapshot(self):
+        """Return the current immutable snapshot"""
+        return self._snapshot
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def subscribe(self, listener, prepare_load=None):
+        """Register a callback for catalog changes
+
+        The listener is called as ``listener(event, products=...,
+        changes=...)`` while the writer lock is held, after the new
+        snapshot has been published, so derived indexes see changes in
+        order. Event ``'load'`` passes the new `products`; event
+        ``'apply'`` passes the `changes` of one batch as a list of
+        ``(product, old)`` pairs in delta order, with `product` None for a
+        removal and `old` None for an insertion.
+
+        Listeners whose state is expensive to rebuild can also pass
+        ``prepare_load(snapshot)``: it builds that state for a new catalog
+        without touching the live one and returns a callable installing
+        it. On a load every preparer runs first, then the snapshot is
+        published and the prepared states installed together, so readers
+        see either the old catalog with the old indexes or the new one
+        with the new. Those listeners get no 'load' event.
+        """
+        self._listeners.append((listener, prepare_load))
+
+    def _notify(self, event, **kwargs):
+        for listener, prepare_load in self._listeners:
+            if event == 'load' and prepare_load is not None:
+                continue
+            listener(event, **kwargs)
+
+    def _install(self, snapshot):
+        """Prepare derived state for a new snapshot, then publish them together"""
+        installs = [prepare_load(snapshot) for _, prepare_load in self._listeners if prepare_load is not None]
+        with self._lock:
+            self._snapshot = snapshot
+            for install in installs:
+                install()
+            self._notify('load', products=snapshot.products())
+
+    def load(self, products):
+        """Replace the whole catalog with the given products"""
+        with self._lock:
+            self._install(CatalogSnapshot.build(self._snapshot.version + 1, products))
+
+    def apply(self, deltas):
+        """Apply a batch of deltas atomically and publish a new version
+
+        Each delta is one of ``('upsert', product)``, ``('patch', id,
+        changes)`` (merge `changes` into the current product) or
+        ``('remove', id)``. Deltas apply in order, so later ones see the
+        effect of earlier ones in the same batch. Either the whole batch is
+        published as one new version or, if a delta is invalid (KeyError
+        for patching an unknown id, ValueError for a malformed delta),
+        nothing is. Returns the number of products that changed.
+        """
+        with self._lock:
+            base = self._snapshot
+            shards = list(base._shards)
+            copied = set()
+            changes = []  # (product or None, old or None) in delta order
+            touched = {}  # id -> product before the batch
+
+            for delta in deltas:
+                op = delta[0]
+                if op == 'upsert':
+                    product = ProductRecord.of(delta[1])
+                    product_id = product['id']
+                elif op in ('patch', 'remove'):
+                    product_id = delta[1]
+                else:
+                    raise ValueError(f"Unknown catalog delta: {op}")
+                shard_index = hash(product_id) % SHARD_COUNT
+                old = shards[shard_index].get(product_id)
+                if op == 'patch':
+                    if old is None:
+                        raise KeyError(product_id)
+                    product = old.replace({**delta[2], 'id': product_id})
+                elif op == 'remove':
+                    if old is None:
+                        continue
+                    product = None
+
+                if shard_index not in copied:
+                    shards[shard_index] = dict(shards[shard_index])
+                    copied.add(shard_index)
+                if product is None:
+                    del shards[shard_index][product_id]
+                else:
+                    shards[shard_index][product_id] = product
+                touched.setdefault(product_id, old)
+                changes.append((product, old))
+
+            if not changes:
+                return 0
+            shards = tuple(shards)
+            self._snapshot = self._publish(base, shards, touched)
+            self._notify('apply', changes=changes)
+            return len(changes)
+
+    def _publish(self, base, shards, touched):
+        """Build the snapshot after a batch, copying only the changed indexes"""
+        posting_changes = {}  # (field, value) -> (added ids, removed ids)
+        prices_removed = []
+        prices_added = []
+        ids_added = []
+        ids_removed = []
+        for product_id, before in touched.items():
+            after = shards[hash(product_id) % SHARD_COUNT].get(product_id)
+            if before is None and after is None:
+                continue
+            if before is None:
+                ids_added.append(product_id)
+            elif after is None:
+                ids_removed.append(product_id)
+            for field in INDEXED_FIELDS:
+                old_value = None if before is None else before.get(field)
+                new_value = None if after is None else after.get(field)
+                if old_value == new_value:
+                    continue
+                if old_value is not None:
+                    posting_changes.setdefault((field, old_value), (set(), set()))[1].add(product_id)
+                if new_value is not None:
+                    posting_changes.setdefault((field, new_value), (set(), set()))[0].add(product_id)
+            old_price = None if before is None else (before.get('price', 0), product_id)
+            new_price = None if after is None else (after.get('price', 0), product_id)
+            if old_price != new_price:
+                if old_price is not None:
+                    prices_removed.append(old_price)
+                if new_price is not None:
+                    prices_added.append(new_price)
+
+        postings = base._postings
+        if posting_changes:
+            postings = dict(postings)
+            copied_fields = set()
+            for (field, value), (added, removed) in posting_changes.items():
+                if field not in copied_fields:
+                    postings[field] = dict(postings[field])
+                    copied_fields.add(field)
+                posting = (postings[field].get(value, frozenset()) - removed) | added
+                if posting:
+                    postings[field][value] = posting
+                else:
+                    postings[field].pop(value, None)
+
+        price_index = base._price_index
+        if prices_removed or prices_added:
+            price_index = price_index.updated(prices_removed, prices_added)
+        ids = base._ids
+        if ids_added or ids_removed:
+            ids = ids.updated(ids_removed, ids_added)
+
+        return CatalogSnapshot(base.version + 1, shards, postings, price_index, ids)
+
+    def upsert(self, product):
+        """Insert a product or replace the existing one with the same id"""
+        self.apply([('upsert', product)])
+
+    def bulk_upsert(self, products):
+        """Insert or replace a batch of products as one new version
+
+        Returns the number of products.
+        """
+        return self.apply(('upsert', product) for product in products)
+
+    def patch(self, product_id, changes):
+        """Merge `changes` into a product, returning the new product
+
+        Raises KeyError if the product does not exist.
+        """
+        with self._lock:
+            self.apply([('patch', product_id, changes)])
+            return self._snapshot.get(product_id)
+
+    def remove(self, product_id):
+        """Remove a product, returning it (or None if it did not exist)"""
+        with self._lock:
+            old = self._snapshot.get(product_id)
+            if old is not None:
+                self.apply([('remove', product_id)])
+            return old
+
+    # ------------------------------------------------------------------
+    # Reads (each against the snapshot current at the time of the call)
+    # ------------------------------------------------------------------
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __iter__(self):
+        return iter(self._snapshot)
+
+    def get(self, product_id):
+        """Return a product by id in O(1), or None"""
+        return self._snapshot.get(product_id)
+
+    def products(self):
+        """Return all products ordered by id"""
+        return self._snapshot.products()
+
+    def head(self, n):
+        """Return the first `n` products without copying the whole catalog"""
+        return self._snapshot.head(n)
+
+    def posting(self, field, value):
+        """Return the set of ids whose `field` equals `value`"""
+        return self._snapshot.posting(field, value)
+
+    def ids_in_price_range(self, min_price=None, max_price=None):
+        return self._snapshot.ids_in_price_range(min_price, max_price)
+
+    def filter_ids(self, min_price=None, max_price=None, within=None, **equals):
+        return self._snapshot.filter_ids(min_price=min_price, max_price=max_price, within=within, **equals)
+
+    def filter(self, min_price=None, max_price=None, within=None, **equals):
+        return self._snapshot.filter(min_price=min_price, max_price=max_price, within=within, **equals)
+
+    def count(self, min_price=None, max_price=None, **equals):
+        return self._snapshot.count(min_price=min_price, max_price=max_price, **equals)
+
+    def page(self, limit, after_id=None, min_price=None, max_price=None, **equals):
+        return self._snapshot.page(limit, after_id=after_id, min_price=min_price, max_price=max_price, **equals)
+
+    def facet_counts(self, min_price=None, max_price=None, within=None, **equals):
+        return self._snapshot.facet_counts(min_price=min_price, max_price=max_price, within=within, **equals)
+
+
+def _in_range(price, min_price, max_price):
+    if min_price is not None and price < min_price:
+        return False
+    if max_price is not None and price > max_price:
+        return False
+    return True
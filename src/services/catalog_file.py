@@ -0,0 +1,294 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from functools import lru_cache
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from src.services.catalog import INDEXED_FIELDS, CatalogQueries, CatalogStore
+from src.services.records import ProductRecord
+
+# magic, exported_at (ns), count, then the byte offsets of the sections:
+# ids, blob offsets, id prices, sorted prices, price ids, postings,
+# postings directory (offset, length) and product blobs
+_HEADER = struct.Struct('<8sQQ9Q')
+_MAGIC = b'FCATLG01'
+
+# Decoded products kept per worker for the current mapping
+DECODE_CACHE_SIZE = 4096
+POSTING_CACHE_SIZE = 256
+
+
+def _product_dict(product):
+    if isinstance(product, ProductRecord):
+        return product.to_dict()
+    return dict(product)
+
+
+def write_catalog_file(path, products):
+    """Serialize products and their indexes into a catalog file at `path`
+
+    The file is written next to `path` and moved into place with
+    os.replace, so readers mapping the old file keep a valid mapping and
+    pick up the new inode on their next refresh. Returns the product count.
+
+    Layout (little-endian, 8-byte aligned sections): header, sorted int64
+    ids, uint64 blob offsets (count + 1), float64 price per id, float64
+    prices sorted with their int64 ids, int64 posting lists, the JSON
+    posting directory ``{field: {value: [start, length]}}`` and finally
+    one compact JSON blob per product, in id order.
+    """
+    products = sorted((_product_dict(p) for p in products), key=lambda p: p['id'])
+    count = len(products)
+    ids = array('q', (p['id'] for p in products))
+    id_prices = array('d', (float(p.get('price') or 0) for p in products))
+    by_price = sorted(range(count), key=lambda i: (id_prices[i], ids[i]))
+    prices = array('d', (id_prices[i] for i in by_price))
+    price_ids = array('q', (ids[i] for i in by_price))
+
+    postings = array('q')
+    directory = {}
+    for field in INDEXED_FIELDS:
+        values = {}
+        for product in products:
+            value = product.get(field)
+            if value is not None:
+                values.setdefault(value, []).append(product['id'])
+        directory[field] = {}
+        for value, value_ids in values.items():
+            directory[field][value] = [len(postings), len(value_ids)]
+            postings.extend(value_ids)
+    directory = json.dumps(directory, ensure_ascii=False).encode('utf-8')
+
+    blob_offsets = array('Q', [0])
+    blobs = []
+    for product in products:
+        blob = json.dumps(product, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        blobs.append(blob)
+        blob_offsets.append(blob_offsets[-1] + len(blob))
+
+    sections = [ids, blob_offsets, id_prices, prices, price_ids, postings]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section) * section.itemsize
+    directory_offset = position
+    blobs_offset = position + len(directory)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, time.time_ns(), count, *offsets,
+                             directory_offset, len(directory), blobs_offset))
+        for section in sections:
+            section.tofile(f)
+        f.write(directory)
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+class MappedSnapshot(CatalogQueries):
+    """Read-only catalog snapshot backed by a memory-mapped catalog file
+
+    Ids, prices and posting lists are read in place from the mapping, so
+    every process mapping the same file shares one copy in the page
+    cache. Products are decoded on access, with a small per-process LRU.
+    """
+
+    def __init__(self, path, version):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.version = version
+        (magic, self.exported_at, count, ids_at, blob_offsets_at, id_prices_at, prices_at,
+         price_ids_at, postings_at, directory_at, directory_length, blobs_at) = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a catalog file: {path}")
+        view = memoryview(self._mmap)
+        self._count = count
+        self._ids = view[ids_at:ids_at + 8 * count].cast('q')
+        self._blob_offsets = view[blob_offsets_at:blob_offsets_at + 8 * (count + 1)].cast('Q')
+        self._id_prices = view[id_prices_at:id_prices_at + 8 * count].cast('d')
+        self._prices = view[prices_at:prices_at + 8 * count].cast('d')
+        self._price_ids = view[price_ids_at:price_ids_at + 8 * count].cast('q')
+        self._postings = view[postings_at:directory_at].cast('q')
+        self._directory = json.loads(self._mmap[directory_at:directory_at + directory_length])
+        self._blobs_at = blobs_at
+        self._record = lru_cache(maxsize=DECODE_CACHE_SIZE)(self._decode)
+        self._posting = lru_cache(maxsize=POSTING_CACHE_SIZE)(self._read_posting)
+
+    def _decode(self, index):
+        start = self._blobs_at + self._blob_offsets[index]
+        end = self._blobs_at + self._blob_offsets[index + 1]
+        return ProductRecord(json.loads(self._mmap[start:end]))
+
+    def _position(self, product_id):
+        index = bisect_left(self._ids, product_id)
+        if index < self._count and self._ids[index] == product_id:
+            return index
+        return None
+
+    def _read_posting(self, field, value):
+        entry = self._directory[field].get(value)
+        if entry is None:
+            return frozenset()
+        start, length = entry
+        return frozenset(self._postings[start:start + length])
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return iter(self.products())
+
+    def get(self, product_id):
+        """Return a product by id in O(log n), or None"""
+        if not isinstance(product_id, int):
+            return None
+        index = self._position(product_id)
+        return None if index is None else self._record(index)
+
+    def products(self):
+        """Return a lazy sequence of all products ordered by id"""
+        return MappedProducts(self)
+
+    def head(self, n):
+        return [self._record(i) for i in range(min(n, self._count))]
+
+    def posting(self, field, value):
+        """Return the set of ids whose `field` equals `value`"""
+        return self._posting(field, value)
+
+    def ids_in_price_range(self, min_price=None, max_price=None):
+        """Return the ids whose price falls in [min_price, max_price]"""
+        lo = 0 if min_price is None else bisect_left(self._prices, min_price)
+        hi = self._count if max_price is None else bisect_right(self._prices, max_price)
+        return set(self._price_ids[lo:hi])
+
+    def _price(self, product_id):
+        return self._id_prices[self._position(product_id)]
+
+    def _all_ids(self):
+        return self._ids
+
+    def _ids_after(self, after_id):
+        start = 0 if after_id is None else bisect_right(self._ids, after_id)
+        return (self._ids[i] for i in range(start, self._count))
+
+    def _posting_sizes(self, field):
+        return {value: length for value, (_, length) in self._directory[field].items()}
+
+
+class MappedProducts(Sequence):
+    """Products of a MappedSnapshot, decoded on access"""
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._snapshot._record(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._snapshot._record(index)
+
+
+class MappedCatalog(CatalogStore):
+    """Read-only catalog served from a shared memory-mapped catalog file
+
+    Every worker maps the same file (see `write_catalog_file` and the
+    ``flask export-catalog`` command), so the catalog costs its size in
+    RAM once per machine rather than once per worker. `maybe_refresh`
+    (run before each request) only stats the file; when it has been
+    replaced, a background thread maps the new file and prepares the
+    listeners' indexes while requests keep using the old snapshot, then
+    publishes both at once. Snapshots taken earlier keep the old mapping
+    until they are dropped.
+
+    Only the core indexes (ids, prices and the INDEXED_FIELDS postings)
+    live in the file. Derived indexes (scoring columns, search and suggest
+    indexes, neighbor table, vectors, cold-start lists) are still built by
+    each worker from the mapped products after every remap.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()  # one remap at a time
+        self._snapshot = _EmptySnapshot()
+        self._listeners = []
+        self._checked_at = 0.0
+        self._generation = 0
+        self._reloading = False
+
+    def _changed(self):
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size) != getattr(self._snapshot, 'file_key', None)
+
+    def refresh(self):
+        """Map the catalog file if it changed and publish it; returns True when remapped
+
+        Runs in the calling thread; the current snapshot and indexes keep
+        serving until the new ones are ready.
+        """
+        with self._refresh_lock:
+            if not self._changed():
+                return False
+            self._generation += 1
+            self._install(MappedSnapshot(self.path, self._generation))
+        return True
+
+    def maybe_refresh(self):
+        """Check the file at most once per `check_interval` seconds, remapping it in the background"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            if self._reloading or not self._changed():
+                return
+        except FileNotFoundError:
+            return  # keep serving the current mapping until a file is exported
+        self._reloading = True
+        threading.Thread(target=self._reload, name='catalog-remap', daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.refresh()
+        except Exception:
+            pass  # keep serving the current mapping; retried on the next check
+        finally:
+            self._reloading = False
+
+    def load(self, products):
+        raise RuntimeError(f"The catalog is read-only; it is mapped from {self.path}")
+
+    def apply(self, deltas):
+        raise RuntimeError(f"The catalog is read-only; it is mapped from {self.path}")
+
+
+class _EmptySnapshot(MappedSnapshot):
+    """Stand-in before the catalog file has been mapped"""
+
+    def __init__(self):
+        self.version = 0
+        self._count = 0
+        self._ids = self._id_prices = self._prices = self._price_ids = self._postings = ()
+        self._directory = {field: {} for field in INDEXED_FIELDS}
+        self._record = self._decode
+        self._posting = self._read_posting
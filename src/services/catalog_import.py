@@ -0,0 +1,154 @@
+import csv
+import gzip
+import io
+import json
+import time
+from itertools import islice
+
+# Separator for list fields (tags, sizes) in CSV feeds
+CSV_LIST_SEPARATOR = '|'
+
+# Keep at most this many error messages in the import report
+MAX_REPORTED_ERRORS = 20
+
+_INT_FIELDS = ('discount', 'reviews')
+_FLOAT_FIELDS = ('price', 'original_price', 'rating')
+_LIST_FIELDS = ('tags', 'sizes')
+_TEXT_FIELDS = ('title', 'brand', 'category', 'color', 'style', 'image', 'description', 'store_url',
+                'gender', 'locale')
+
+
+def open_feed(path):
+    """Open a feed file as a text stream, transparently un-gzipping .gz files"""
+    if path == '-':
+        import sys
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def iter_jsonl(stream):
+    """Yield ``(line_number, row)`` from a JSON-lines text stream"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+
+def iter_csv(stream):
+    """Yield ``(line_number, row)`` from a CSV text stream with a header row"""
+    for line_number, row in enumerate(csv.DictReader(stream), start=2):
+        yield line_number, row
+
+
+def iter_feed(stream, fmt):
+    if fmt == 'csv':
+        return iter_csv(stream)
+    if fmt == 'jsonl':
+        return iter_jsonl(stream)
+    raise ValueError(f"Unsupported feed format: {fmt}")
+
+
+def _number(value, cast):
+    if value is None or value == '':
+        return None
+    number = cast(value)
+    if cast is float and number.is_integer():
+        return int(number)
+    return number
+
+
+def normalize_product(row):
+    """Validate a raw feed row and return a catalog product dict
+
+    Raises ValueError with a readable message for invalid rows.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("row is not an object")
+    try:
+        product_id = int(row.get('id'))
+    except (TypeError, ValueError):
+        raise ValueError("missing or invalid id")
+    title = str(row.get('title') or '').strip()
+    if not title:
+        raise ValueError(f"product {product_id}: missing title")
+
+    product = {"id": product_id, "title": title}
+    for field in _TEXT_FIELDS[1:]:
+        value = row.get(field)
+        if not isinstance(value, (str, int, float)) and value is not None:
+            raise ValueError(f"product {product_id}: {field} must be text")
+        product[field] = str(value).strip() if value not in (None, '') else None
+    try:
+        for field in _FLOAT_FIELDS + _INT_FIELDS:
+            if isinstance(row.get(field), bool):
+                raise TypeError(field)
+        for field in _FLOAT_FIELDS:
+            product[field] = _number(row.get(field), float)
+        for field in _INT_FIELDS:
+            product[field] = _number(row.get(field), int)
+    except (TypeError, ValueError):
+        raise ValueError(f"product {product_id}: invalid number in {field}")
+    if product['price'] is None:
+        raise ValueError(f"product {product_id}: missing price")
+    if product['price'] < 0:
+        raise ValueError(f"product {product_id}: negative price")
+    for field in _LIST_FIELDS:
+        value = row.get(field) or []
+        if isinstance(value, str):
+            value = value.split(CSV_LIST_SEPARATOR)
+        if not isinstance(value, (list, tuple)) or not all(isinstance(v, (str, int, float)) for v in value):
+            raise ValueError(f"product {product_id}: {field} must be a list of strings")
+        product[field] = [str(v).strip() for v in value if str(v).strip()]
+    return product
+
+
+def import_feed(rows, catalog, sql_catalog=None, batch_size=5000, on_progress=None):
+    """Stream `(line_number, row)` pairs into the catalog in batches
+
+    Memory use is bounded by `batch_size`, whatever the feed size. Each
+    valid batch is applied with one SqlCatalog.bulk_load when given and
+    one CatalogStore.bulk_upsert unless `catalog` is None (so catalog
+    listeners see one change batch per chunk). `on_progress(stats)` is
+    called after every batch. Returns the import statistics.
+    """
+    stats = {"rows": 0, "imported": 0, "rejected": 0, "errors": []}
+    started = time.monotonic()
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        batch = []
+        for line_number, row in chunk:
+            stats["rows"] += 1
+            try:
+                if isinstance(row, Exception):
+                    raise ValueError(f"invalid JSON: {row}")
+                batch.append(normalize_product(row))
+            except ValueError as e:
+                stats["rejected"] += 1
+                if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+                    stats["errors"].append(f"line {line_number}: {e}")
+        if batch:
+            if sql_catalog is not None:
+                sql_catalog.bulk_load(batch)
+            if catalog is not None:
+                catalog.bulk_upsert(batch)
+            stats["imported"] += len(batch)
+        _update_rate(stats, started)
+        if on_progress is not None:
+            on_progress(stats)
+    _update_rate(stats, started)
+    return stats
+
+
+def _update_rate(stats, started):
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_sec"] = round(stats["rows"] / elapsed) if elapsed > 0 else stats["rows"]
@@ -0,0 +1,189 @@
+import heapq
+import math
+import threading
+import time
+from datetime import datetime
+
+# Bayesian rating prior: products with few reviews are pulled towards it
+PRIOR_RATING = 4.0
+PRIOR_REVIEWS = 20
+
+# Weight of one decayed trending event relative to one historic review
+ENGAGEMENT_WEIGHT = 5.0
+
+# Newer products get a boost that halves every RECENCY_HALF_LIFE seconds
+# and never drops below RECENCY_FLOOR
+RECENCY_HALF_LIFE = 14 * 24 * 3600
+RECENCY_FLOOR = 0.5
+
+# Product fields with their own ranked lists (e.g. ?gender=women)
+SEGMENT_FIELDS = ('gender', 'locale')
+
+
+def _timestamp(value):
+    """Return `value` (epoch seconds or ISO date string) as epoch seconds, or None"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+class ColdStartRanker:
+    """Precomputed popularity × rating × recency rankings for anonymous users
+
+    A background thread scores the whole catalog every `interval` seconds
+    (and right after a catalog load) and publishes the best `list_size`
+    ids overall and per segment value of SEGMENT_FIELDS, along with every
+    product's score, in one reference swap. Requests only read the
+    published lists, so users without a profile never trigger scoring.
+
+    Popularity blends historic reviews with the decayed trending
+    engagement, the rating is a Bayesian average, and recency comes from
+    the product's ``created_at`` field or, failing that, from when the
+    ranker first saw it.
+    """
+
+    def __init__(self, catalog, trending, interval=300, list_size=500,
+                 segment_fields=SEGMENT_FIELDS, clock=time.time):
+        self.catalog = catalog
+        self.trending = trending
+        self.interval = interval
+        self.list_size = list_size
+        self.segment_fields = segment_fields
+        self.clock = clock
+        self._started_at = clock()
+        self._first_seen = {}  # product id -> time it was added after startup
+        self._published = ({}, {}, None)  # (lists, scores, built_at)
+        self._wake = threading.Event()
+        self._thread = None
+        self.builds = 0
+        self.build_seconds = 0.0
+
+    def start(self):
+        """Start the background scheduling thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cold-start', daemon=True)
+            self._thread.start()
+
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener; tracks new products and rebuilds after a load"""
+        if event == 'load':
+            self._wake.set()
+            return
+        now = self.clock()
+        for product, old in changes:
+            if product is None:
+                self._first_seen.pop(old['id'], None)
+            elif old is None:
+                self._first_seen[product['id']] = now
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                self.rebuild()
+            except Exception:
+                pass  # keep serving the previous lists until the next run
+            self._wake.wait(self.interval)
+
+    def score(self, product, now=None, engagement=None):
+        """Return the cold-start score of one product"""
+        now = self.clock() if now is None else now
+        reviews = product.get('reviews') or 0
+        if engagement is None:
+            engagement = self.trending.score(product['id'])
+        popularity = 1 + math.log1p(reviews + ENGAGEMENT_WEIGHT * engagement)
+
+        rating = product.get('rating') or PRIOR_RATING
+        rating = (rating * reviews + PRIOR_RATING * PRIOR_REVIEWS) / (reviews + PRIOR_REVIEWS) / 5
+
+        added_at = _timestamp(product.get('created_at'))
+        if added_at is None:
+            added_at = self._first_seen.get(product['id'], self._started_at)
+        age = max(0.0, now - added_at)
+        recency = RECENCY_FLOOR + (1 - RECENCY_FLOOR) * 2 ** (-age / RECENCY_HALF_LIFE)
+
+        return popularity * rating * recency
+
+    def rebuild(self):
+        """Score the catalog and publish fresh ranked lists"""
+        started = time.monotonic()
+        now = self.clock()
+        engagement = self.trending.scores()
+        scores = {}
+        members = {}  # (field, value) -> ids
+        for product in self.catalog.snapshot().products():
+            product_id = product['id']
+            scores[product_id] = self.score(product, now, engagement.get(product_id, 0.0))
+            for field in self.segment_fields:
+                values = product.get(field)
+                if values is None:
+                    continue
+                if not isinstance(values, (list, tuple)):
+                    values = (values,)
+                for value in values:
+                    members.setdefault((field, value), []).append(product_id)
+
+        def ranked(ids):
+            return heapq.nlargest(self.list_size, ids, key=lambda i: (scores[i], -i))
+
+        lists = {None: ranked(scores)}
+        for segment, ids in members.items():
+            lists[segment] = ranked(ids)
+        self._published = (lists, scores, now)
+        self.builds += 1
+        self.build_seconds = round(time.monotonic() - started, 3)
+
+    def ready(self):
+        """Whether the first lists have been published"""
+        return self._published[2] is not None
+
+    def top(self, limit, offset=0, segment=None):
+        """Return up to `limit` products, best first, from the published lists
+
+        `segment` is a ``(field, value)`` pair; its list is topped up from
+        the overall list. Products removed since the last build are skipped.
+        """
+        lists = self._published[0]
+        ranking = lists.get(None, [])
+        if segment is not None:
+            segment_ranking = lists.get(segment, [])
+            listed = set(segment_ranking)
+            ranking = segment_ranking + [i for i in ranking if i not in listed]
+        products = []
+        for product_id in ranking[offset:]:
+            product = self.catalog.get(product_id)
+            if product is not None:
+                products.append(product)
+                if len(products) >= limit:
+                    break
+        return products
+
+    def score_of(self, product_id):
+        """Return the published score of a product normalized to 0-1
+
+        Products added since the last build are scored on the spot.
+        """
+        lists, scores, _ = self._published
+        score = scores.get(product_id)
+        if score is None:
+            product = self.catalog.get(product_id)
+            score = self.score(product) if product is not None else 0.0
+        best = lists.get(None)
+        top_score = scores.get(best[0]) if best else None
+        return min(1.0, score / top_score) if top_score else 0.0
+
+    def stats(self):
+        lists, scores, built_at = self._published
+        return {
+            "products": len(scores),
+            "segments": len(lists) - 1 if lists else 0,
+            "builds": self.builds,
+            "build_seconds": self.build_seconds,
+            "built_at": datetime.fromtimestamp(built_at).isoformat() if built_at else None,
+            "interval": self.interval
+        }
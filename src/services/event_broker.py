@@ -0,0 +1,88 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+# Events after which a topic receives nothing more
+TERMINAL_EVENTS = frozenset({'completed', 'failed'})
+
+
+class EventBroker:
+    """In-process publish/wait hub for per-session events
+
+    Each topic (a try-on session id) keeps its last `history` events with
+    increasing ids, so a client that reconnects with the last id it saw
+    (SSE ``Last-Event-ID`` or the long-poll ``since``) misses nothing.
+    Waiters block on a per-topic condition and wake only for their own
+    topic. Topics are dropped `retention` seconds after a terminal event.
+    """
+
+    def __init__(self, history=64, retention=600):
+        self.history = history
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._topics = {}  # topic -> (condition, deque of (id, event, data))
+        self._finished = {}  # topic -> time of its terminal event
+        self._ids = itertools.count(1)
+
+    def _topic(self, topic):
+        entry = self._topics.get(topic)
+        if entry is None:
+            entry = self._topics[topic] = (threading.Condition(self._lock), deque(maxlen=self.history))
+        return entry
+
+    def publish(self, topic, event, data):
+        """Append an event to a topic and wake its waiters; returns the event id"""
+        now = time.monotonic()
+        with self._lock:
+            condition, events = self._topic(topic)
+            event_id = next(self._ids)
+            events.append((event_id, event, data))
+            if event in TERMINAL_EVENTS:
+                self._finished[topic] = now
+            condition.notify_all()
+            self._prune(now)
+        return event_id
+
+    def _prune(self, now):
+        while self._finished:
+            topic, finished_at = next(iter(self._finished.items()))
+            if now - finished_at < self.retention:
+                break
+            del self._finished[topic]
+            self._topics.pop(topic, None)
+
+    def last_id(self, topic):
+        """Return the id of the latest event on a topic, or 0"""
+        with self._lock:
+            entry = self._topics.get(topic)
+            return entry[1][-1][0] if entry and entry[1] else 0
+
+    def wait(self, topic, since=0, timeout=None):
+        """Return ``[(id, event, data), ...]`` published after `since`
+
+        Blocks up to `timeout` seconds until there is at least one; returns
+        an empty list on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            condition, events = self._topic(topic)
+            while True:
+                pending = [item for item in events if item[0] > since]
+                if pending:
+                    return pending
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                condition.wait(remaining)
+
+    def on_job_update(self, job_id, event, changes):
+        """Try-on job listener; publishes each job update to the session's topic"""
+        self.publish(job_id, event, changes)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "topics": len(self._topics),
+                "finished": len(self._finished)
+            }
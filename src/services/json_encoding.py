@@ -0,0 +1,157 @@
+import json
+import re
+import threading
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+from src.services.records import ProductRecord, ProductView
+
+# orjson >= 3.9 can embed pre-encoded JSON directly
+_ORJSON_FRAGMENT = getattr(orjson, 'Fragment', None)
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(o):
+    if isinstance(o, (ProductRecord, ProductView)):
+        return o.to_dict()
+    return DefaultJSONProvider.default(o)
+
+
+def encode(obj):
+    """Encode plain JSON data to UTF-8 bytes (orjson when available)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FragmentCache:
+    """Encoded JSON of each product, reused across responses
+
+    Entries remember the record they were encoded from and are only
+    served for that same (immutable) record, so a changed product is
+    never served stale; the catalog listener also drops entries as
+    products change, to free their memory.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._entries = {}  # product id -> (record, encoded bytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, product):
+        entry = self._entries.get(product['id'])
+        if entry is not None and entry[0] is product:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        data = encode(product.to_dict())
+        with self._lock:
+            self._entries[product['id']] = (product, data)
+            while len(self._entries) > self.maxsize:
+                del self._entries[next(iter(self._entries))]
+        return data
+
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener dropping fragments of changed products"""
+        with self._lock:
+            if event == 'load':
+                self._entries = {}
+                return
+            for _, old in changes:
+                if old is not None:
+                    self._entries.pop(old['id'], None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+# Shared by the JSON provider and `view_json`
+product_fragments = FragmentCache()
+
+
+def view_json(view, fragments=product_fragments):
+    """Encode a ProductView as its product's cached JSON plus its fields
+
+    The fields are spliced in by rewriting the fragment's closing brace,
+    so the product itself is not re-encoded.
+    """
+    product, fields = view.product, view.fields
+    if not isinstance(product, ProductRecord):
+        return encode(view.to_dict())
+    data = fragments.get(product)
+    if not fields:
+        return data
+    if any(key in product for key in fields):
+        return encode(view.to_dict())
+    return data[:-1] + b',' + encode(fields)[1:]
+
+
+def dumps_bytes(obj, fragments=product_fragments):
+    """Encode a response, splicing in cached product fragments"""
+    if _ORJSON_FRAGMENT is not None:
+        def default(o):
+            if isinstance(o, ProductRecord):
+                return _ORJSON_FRAGMENT(fragments.get(o))
+            if isinstance(o, ProductView):
+                return _ORJSON_FRAGMENT(view_json(o, fragments))
+            return DefaultJSONProvider.default(o)
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+
+    # Encode a unique placeholder string per fragment, then substitute
+    raw = []
+    nonce = f'\x00{id(raw):x}:'
+
+    def default(o):
+        if isinstance(o, ProductRecord):
+            raw.append(fragments.get(o))
+        elif isinstance(o, ProductView):
+            raw.append(view_json(o, fragments))
+        else:
+            return DefaultJSONProvider.default(o)
+        return f'{nonce}{len(raw) - 1}\x00'
+
+    if orjson is not None:
+        data = orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    else:
+        data = json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if not raw:
+        return data
+    placeholder = re.compile(rb'"\\u0000' + nonce[1:].encode('ascii') + rb'(\d+)\\u0000"')
+    return placeholder.sub(lambda m: raw[int(m.group(1))], data)
+
+
+class ProductJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider with cached product fragments and a fast encoder
+
+    Responses are encoded straight to UTF-8 bytes with orjson when it is
+    installed (json otherwise); ProductRecords and ProductViews are
+    spliced in from `product_fragments` instead of being re-encoded on
+    every request. Keys are not sorted and non-ASCII text is not escaped.
+    """
+
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,205 @@
+import sys
+from collections.abc import Mapping
+
+# Product fields stored in slots, in the order of the catalog feeds
+PRODUCT_FIELDS = (
+    'id', 'title', 'brand', 'price', 'original_price', 'discount', 'category', 'color',
+    'style', 'image', 'description', 'tags', 'sizes', 'rating', 'reviews', 'store_url',
+    'gender', 'locale'
+)
+_FIELD_SET = frozenset(PRODUCT_FIELDS)
+
+# Low-cardinality string fields shared across products via sys.intern
+INTERNED_FIELDS = ('brand', 'category', 'color', 'style', 'gender', 'locale')
+
+# List fields stored as tuples; identical `sizes` tuples are shared too
+LIST_FIELDS = ('tags', 'sizes')
+_MAX_SHARED_TUPLES = 10000
+_shared_tuples = {}
+
+
+def _share(values):
+    shared = _shared_tuples.get(values)
+    if shared is None:
+        shared = values
+        if len(_shared_tuples) < _MAX_SHARED_TUPLES:
+            _shared_tuples[values] = values
+    return shared
+
+
+def _compact(field, value):
+    if value is None:
+        return None
+    if field in INTERNED_FIELDS and isinstance(value, str):
+        return sys.intern(value)
+    if field in LIST_FIELDS:
+        values = tuple(sys.intern(v) if isinstance(v, str) else v for v in value)
+        return _share(values) if field == 'sizes' else values
+    return value
+
+
+class ProductRecord(Mapping):
+    """Read-only, slotted product record
+
+    Takes a fraction of the memory of the equivalent dict: the fixed
+    fields live in slots, brand/category/color/style strings are
+    interned, and tags/sizes are tuples (identical size runs shared).
+    Fields outside PRODUCT_FIELDS go to a small `_extra` dict. A None
+    value means the field is absent, as with a dict missing that key.
+    Records behave as a Mapping (``get``, ``[]``, ``**record``) and are
+    serialized to the usual product JSON by ProductJSONProvider.
+    """
+
+    __slots__ = PRODUCT_FIELDS + ('_extra',)
+
+    def __init__(self, fields):
+        extra = None
+        for key, value in fields.items():
+            if key in _FIELD_SET:
+                continue
+            if value is not None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        set_slot = object.__setattr__
+        for field in PRODUCT_FIELDS:
+            set_slot(self, field, _compact(field, fields.get(field)))
+        set_slot(self, '_extra', extra)
+
+    @classmethod
+    def of(cls, product):
+        """Return `product` as a record, converting dicts"""
+        return product if isinstance(product, cls) else cls(product)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ProductRecord is read-only")
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        for field in PRODUCT_FIELDS:
+            if getattr(self, field) is not None:
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.to_dict() == {k: list(v) if isinstance(v, tuple) else v for k, v in other.items()}
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (type(self), (self.to_dict(),))
+
+    def __repr__(self):
+        return f"ProductRecord({self.to_dict()!r})"
+
+    def replace(self, changes):
+        """Return a new record with `changes` applied"""
+        return type(self)({**self, **changes})
+
+    def to_dict(self):
+        """Return the product as a plain dict in the API's JSON shape"""
+        product = {}
+        for field in PRODUCT_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                product[field] = list(value) if field in LIST_FIELDS else value
+        if self._extra is not None:
+            product.update(self._extra)
+        return product
+
+
+class ProductView(Mapping):
+    """Read-only product with per-request fields layered on top
+
+    Route handlers annotate catalog products (match scores, reasons,
+    engagement counts) through views instead of copying or mutating the
+    shared product: the view keeps a reference to the product and a small
+    dict of extra fields that shadow it. Views of views are flattened.
+    """
+
+    __slots__ = ('product', '_fields')
+
+    def __init__(self, product, **fields):
+        if isinstance(product, ProductView):
+            fields = {**product._fields, **fields}
+            product = product.product
+        object.__setattr__(self, 'product', product)
+        object.__setattr__(self, '_fields', fields)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ProductView is read-only")
+
+    @property
+    def fields(self):
+        """The per-request fields, as a new dict"""
+        return dict(self._fields)
+
+    def with_fields(self, **fields):
+        """Return a new view with more fields"""
+        return ProductView(self, **fields)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return self._fields[key]
+        return self.product[key]
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return self._fields[key]
+        return self.product.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._fields or key in self.product
+
+    def __iter__(self):
+        for key in self.product:
+            if key not in self._fields:
+                yield key
+        yield from self._fields
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (_product_view, (self.product, self._fields))
+
+    def __repr__(self):
+        return f"ProductView({self.product!r}, **{self._fields!r})"
+
+    def to_dict(self):
+        """Return the product and its fields as a plain dict"""
+        product = self.product.to_dict() if hasattr(self.product, 'to_dict') else dict(self.product)
+        product.update(self._fields)
+        return product
+
+
+def _product_view(product, fields):
+    return ProductView(product, **fields)
@@ -0,0 +1,382 @@
+import heapq
+import threading
+from array import array
+from collections import namedtuple
+
+from src.services.cache import TTLCache
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+# Style groups used by the rule-based match score
+CASUAL_TRENDY = ('casual', 'trendy')
+CASUAL_CLASSIC = ('casual', 'classic')
+CLASSIC_FORMAL = ('classic', 'formal')
+HOURGLASS_CATEGORIES = ('فستان', 'تنورة')
+RECTANGLE_CATEGORIES = ('جاكيت', 'بدلة')
+
+# Inclusive (min, max) price bounds per budget bucket
+BUDGET_RANGES = {
+    '0-100': (None, 100),
+    '100-300': (100, 300),
+    '300-500': (300, 500),
+    '500-1000': (500, 1000),
+    '1000+': (1000, None)
+}
+
+# Encoded catalog rows; removed products stay as `dead` rows until the next full encode
+ScoringState = namedtuple('ScoringState', ['version', 'ids', 'size', 'columns', 'style_codes', 'positions', 'dead'])
+
+
+def scoring_key(product):
+    """Return the product fields the match score depends on
+
+    Price only matters through the budget buckets it falls in, so a
+    price change inside the same buckets leaves every score unchanged.
+    """
+    price = product.get('price', 0)
+    buckets = tuple(
+        (low is None or price >= low) and (high is None or price <= high)
+        for low, high in BUDGET_RANGES.values()
+    )
+    return (product.get('style'), product.get('category', ''), buckets)
+
+
+def _encode_columns(products, style_codes):
+    # Adds unseen styles to `style_codes`
+    styles = [p.get('style') for p in products]
+    categories = [p.get('category', '') for p in products]
+    return {
+        'style': np.array([style_codes.setdefault(s, len(style_codes)) for s in styles], dtype=np.int32),
+        'casual_trendy': np.array([s in CASUAL_TRENDY for s in styles], dtype=bool),
+        'casual_classic': np.array([s in CASUAL_CLASSIC for s in styles], dtype=bool),
+        'classic_formal': np.array([s in CLASSIC_FORMAL for s in styles], dtype=bool),
+        'has_category': np.array([bool(c) for c in categories], dtype=bool),
+        'hourglass': np.array([c in HOURGLASS_CATEGORIES for c in categories], dtype=bool),
+        'rectangle': np.array([c in RECTANGLE_CATEGORIES for c in categories], dtype=bool),
+        'price': np.array([p.get('price', 0) for p in products], dtype=np.float64),
+    }
+
+
+class CatalogScorer:
+    """Columnar, vectorized version of FashionAIEngine.calculate_match_score
+
+    Product attributes are encoded into NumPy arrays, one row per product,
+    so scoring a profile against the whole catalog is a handful of array
+    operations. Scores are identical to the rule-based implementation.
+
+    The scorer is a catalog listener: a load is encoded off to the side,
+    while upserts and removals are queued and applied to their own rows on
+    the next read. New products get rows at the end and removed ones are
+    masked out until enough have piled up to re-encode. `version` changes
+    only when a score or the set of products can change, so price and
+    stock updates keep every cache keyed on it.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = []  # (product or None, old or None) not applied yet
+        self._reset = True  # re-encode the whole catalog on the next read
+        self._state = ScoringState(0, [], 0, {}, {}, {}, frozenset())
+
+    @property
+    def vectorized(self):
+        return np is not None
+
+    @property
+    def version(self):
+        """Version of the encoded rows; changes only when scores can change"""
+        return self._ensure_columns().version
+
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener; queues changed products for `_ensure_columns`"""
+        with self._pending_lock:
+            if event == 'load':
+                self._pending = []
+                self._reset = True
+            else:
+                self._pending.extend(changes)
+
+    def prepare_load(self, snapshot):
+        """Encode a new catalog off to the side; returns a callable that swaps it in"""
+        state = self._encode(snapshot, 0)
+
+        def install():
+            with self._lock:
+                with self._pending_lock:
+                    self._pending = []
+                    self._reset = False
+                self._state = state._replace(version=self._state.version + 1)
+        return install
+
+    def _ensure_columns(self):
+        if not self._pending and not self._reset:
+            return self._state
+        with self._lock:
+            with self._pending_lock:
+                changes, self._pending = self._pending, []
+                reset, self._reset = self._reset, False
+            state = self._state
+            if not reset and changes:
+                state = self._apply(state, changes)
+                reset = len(state.dead) * 4 > state.size
+            if reset:
+                state = self._encode(self.catalog.snapshot(), state.version + 1)
+            self._state = state
+            return state
+
+    def _encode(self, snapshot, version):
+        products = snapshot.products()
+        ids = [p['id'] for p in products]
+        positions = {product_id: i for i, product_id in enumerate(ids)}
+        style_codes = {}
+        columns = _encode_columns(products, style_codes) if np is not None else {}
+        return ScoringState(version, ids, len(ids), columns, style_codes, positions, frozenset())
+
+    def _apply(self, state, changes):
+        """Apply queued changes to the rows they touch
+
+        `ids` and `positions` are extended in place, which readers of the
+        previous state tolerate since they stay within its `size`; the
+        columns are copied before rows are rewritten.
+        """
+        ids, positions = state.ids, state.positions
+        dead = set(state.dead)
+        rows = {}  # position -> product to encode there
+        for product, old in changes:
+            if product is None:
+                position = positions.pop(old['id'], None)
+                if position is not None:
+                    dead.add(position)
+                    rows.pop(position, None)
+                continue
+            position = positions.get(product['id'])
+            if position is None:
+                position = len(ids)
+                ids.append(product['id'])
+                positions[product['id']] = position
+                rows[position] = product
+            elif position in rows or old is None or scoring_key(product) != scoring_key(old):
+                rows[position] = product
+        if not rows and len(dead) == len(state.dead):
+            return state  # nothing a score depends on changed
+
+        columns, style_codes = state.columns, state.style_codes
+        if rows and np is not None:
+            style_codes = dict(style_codes)
+            grow = len(ids) - state.size
+            columns = {
+                name: np.concatenate([column, np.zeros(grow, dtype=column.dtype)]) if grow else column.copy()
+                for name, column in columns.items()
+            }
+            targets = np.fromiter(rows, dtype=np.int64, count=len(rows))
+            for name, values in _encode_columns(list(rows.values()), style_codes).items():
+                columns[name][targets] = values
+        return ScoringState(state.version + 1, ids, len(ids), columns, style_codes, positions, frozenset(dead))
+
+    def score(self, user_profile):
+        """Return an int16 array of match scores, one per encoded row"""
+        return self._score(user_profile, self._ensure_columns())
+
+    def _score(self, user_profile, state):
+        cols, style_codes = state.columns, state.style_codes
+        n = state.size
+        scores = np.zeros(n, dtype=np.int16)
+
+        # Style matching (40% weight)
+        style = user_profile.get('style')
+        same_style = cols['style'] == style_codes.get(style, -1)
+        scores += np.where(same_style, 40, 0).astype(np.int16)
+        if style in CASUAL_TRENDY:
+            scores += np.where(~same_style & cols['casual_trendy'], 30, 0).astype(np.int16)
+
+        # Body type and product category matching (30% weight)
+        body_type = user_profile.get('body_type', '')
+        if body_type:
+            if body_type == 'hourglass':
+                good = cols['hourglass']
+            elif body_type == 'rectangle':
+                good = cols['rectangle']
+            else:
+                good = np.zeros(n, dtype=bool)
+            scores += np.where(cols['has_category'], np.where(good, 30, 20), 0).astype(np.int16)
+
+        # Budget matching (20% weight)
+        budget = user_profile.get('budget', '')
+        if budget:
+            bounds = BUDGET_RANGES.get(budget)
+            if bounds is None:
+                in_budget = np.zeros(n, dtype=bool)
+            else:
+                in_budget = np.ones(n, dtype=bool)
+                if bounds[0] is not None:
+                    in_budget &= cols['price'] >= bounds[0]
+                if bounds[1] is not None:
+                    in_budget &= cols['price'] <= bounds[1]
+            scores += np.where(in_budget, 20, 10).astype(np.int16)
+
+        # Age and style appropriateness (10% weight)
+        age = user_profile.get('age', 25)
+        if age:
+            age = int(age)
+            if 18 <= age <= 25:
+                suits_age = cols['casual_trendy']
+            elif 26 <= age <= 35:
+                suits_age = cols['casual_classic']
+            elif age >= 36:
+                suits_age = cols['classic_formal']
+            else:
+                suits_age = np.zeros(n, dtype=bool)
+            scores += np.where(suits_age, 10, 5).astype(np.int16)
+
+        if state.dead:
+            scores[list(state.dead)] = 0
+        return np.minimum(scores, 100)
+
+    def top_k(self, user_profile, k):
+        """Return the best `k` (product, score) pairs, highest score first
+
+        Ties are broken by row order, which is catalog order as of the last
+        full encode with newer products after it, so both paths can be
+        compared item for item on a freshly loaded catalog.
+        """
+        state = self._ensure_columns()
+        return self.resolve(state, self._score(user_profile, state), k)
+
+    def resolve(self, state, scores, k, ranked=None):
+        """Return the best `k` live (product, score) pairs from per-row scores
+
+        `ranked` is an already computed ranking of at least `k` live rows.
+        Products are looked up in the current catalog, so they carry their
+        latest price and stock.
+        """
+        if ranked is None or len(ranked) < k:
+            ranked = [i for i in top_indices(scores, k + len(state.dead)) if i not in state.dead]
+        results = []
+        for i in ranked[:k]:
+            product = self.catalog.get(state.ids[i])
+            if product is not None:
+                results.append((product, int(scores[i])))
+        return results
+
+
+def top_indices(scores, k):
+    """Return the positions of the `k` highest scores, best first
+
+    Ties are broken by position (catalog order), which is what a stable
+    descending sort produces. Uses np.partition for NumPy arrays and a
+    bounded heap otherwise.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return []
+    if np is None or not isinstance(scores, np.ndarray):
+        return heapq.nlargest(k, range(n), key=scores.__getitem__)
+    if k < n:
+        kth = np.partition(scores, n - k)[n - k]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - len(above)]
+        picked = np.concatenate([above, ties])
+    else:
+        picked = np.arange(n)
+    return picked[np.lexsort((picked, -scores[picked].astype(np.int32)))].tolist()
+
+
+def profile_bucket(user_profile):
+    """Return the canonical key of the profile fields the match score uses
+
+    calculate_match_score and get_recommendation_reason only look at the
+    style, a coarse body type, the budget bucket and the age bracket, so
+    every profile with the same key gets exactly the same scores and
+    reasons.
+    """
+    body_type = user_profile.get('body_type', '')
+    if body_type and body_type not in ('hourglass', 'rectangle'):
+        body_type = 'other'
+
+    budget = user_profile.get('budget', '')
+    if budget and budget not in BUDGET_RANGES:
+        budget = 'other'
+
+    age = user_profile.get('age', 25)
+    if not age:
+        age_bracket = None
+    else:
+        age = int(age)
+        if 18 <= age <= 25:
+            age_bracket = '18-25'
+        elif 26 <= age <= 35:
+            age_bracket = '26-35'
+        elif age >= 36:
+            age_bracket = '36+'
+        else:
+            age_bracket = 'other'
+
+    return (user_profile.get('style'), body_type or None, budget or None, age_bracket)
+
+
+class ProfileBucketCache:
+    """Shared, bounded memo of per-bucket match scores and rankings
+
+    Each entry holds one uint8 score per scorer row plus the top `depth`
+    ranking, both tagged with the scorer version, so only changes that can
+    move a score invalidate them. Recommendations and personalized search
+    for any profile in a cached bucket are lookups.
+    """
+
+    def __init__(self, scorer, maxsize=128, depth=100):
+        self.scorer = scorer
+        self.depth = depth
+        self._cache = TTLCache(maxsize=maxsize)
+
+    def _entry(self, user_profile):
+        bucket = profile_bucket(user_profile)
+        state = self.scorer._ensure_columns()
+        entry = self._cache.get(bucket, tag=state.version)
+        if entry is None:
+            if np is not None:
+                scores = self.scorer._score(user_profile, state).astype(np.uint8)
+            else:
+                from src.main import FashionAIEngine
+                snapshot = self.scorer.catalog.snapshot()
+                products = (snapshot.get(product_id) for product_id in state.ids[:state.size])
+                scores = array('B', (
+                    0 if p is None else FashionAIEngine.calculate_match_score(user_profile, p)
+                    for p in products
+                ))
+            ranked = [i for i in top_indices(scores, self.depth + len(state.dead)) if i not in state.dead]
+            entry = (state, scores, ranked[:self.depth])
+            self._cache.set(bucket, entry, tag=state.version)
+        return entry
+
+    def top_k(self, user_profile, k):
+        """Return the best `k` (product, score) pairs for the profile's bucket"""
+        state, scores, ranked = self._entry(user_profile)
+        return self.scorer.resolve(state, scores, k, ranked)
+
+    def score_of(self, user_profile, product_id):
+        """Return the match score of one product, or None if it is unknown"""
+        return self.scorer_for(user_profile)(product_id)
+
+    def scorer_for(self, user_profile):
+        """Return a ``score_of(product_id)`` function bound to the profile's bucket
+
+        The bucket entry is resolved once, so scoring many products costs
+        a dict lookup and an array read each.
+        """
+        state, scores, _ = self._entry(user_profile)
+        positions, size = state.positions, state.size
+
+        def score_of(product_id):
+            position = positions.get(product_id)
+            if position is None or position >= size:
+                return None  # added after this entry's rows were encoded
+            return int(scores[position])
+        return score_of
+
+    def stats(self):
+        return self._cache.stats()
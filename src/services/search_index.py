@@ -0,0 +1,244 @@
+from bisect import bisect_left
+import math
+import re
+import threading
+
+# Text fields indexed for smart search
+SEARCH_FIELDS = ('title', 'tags', 'description')
+
+# Shortest prefix that gets expanded to all matching terms
+MIN_PREFIX_LENGTH = 2
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_TOKEN = re.compile(r'\w+')
+_LETTER_MAP = str.maketrans({
+    'أ': 'ا',
+    'إ': 'ا',
+    'آ': 'ا',
+    'ٱ': 'ا',
+    'ة': 'ه',
+    'ى': 'ي',
+    'ؤ': 'و',
+    'ئ': 'ي'
+})
+
+
+def normalize_text(text):
+    """Normalize text for matching: case, Arabic diacritics and letter variants"""
+    text = _DIACRITICS.sub('', str(text))
+    return text.translate(_LETTER_MAP).casefold()
+
+
+def tokenize(text):
+    """Split text into normalized tokens, dropping the Arabic definite article"""
+    tokens = []
+    for token in _TOKEN.findall(normalize_text(text)):
+        if token.startswith('ال') and len(token) > 3:
+            token = token[2:]
+        tokens.append(token)
+    return tokens
+
+
+def product_tokens(product):
+    """Return the tokens of all searchable fields of a product"""
+    tokens = []
+    for field in SEARCH_FIELDS:
+        value = product.get(field)
+        if not value:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ' '.join(str(v) for v in value)
+        tokens.extend(tokenize(value))
+    return tokens
+
+
+class SearchIndex:
+    """Tokenizing inverted index over product title, tags and description
+
+    Postings map each term to ``{product_id: term_frequency}``. A sorted
+    term list supports prefix expansion with bisect. The index subscribes
+    to catalog changes and is updated incrementally.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._terms = []  # sorted list of indexed terms
+        self._doc_terms = {}  # product id -> {term: tf}
+        self._doc_lengths = {}  # product id -> number of tokens
+        self._total_length = 0
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener keeping the index in sync"""
+        if event == 'load':
+            self.build(products)
+            return
+        with self._lock:
+            for product, old in changes:
+                if product is None:
+                    self.remove(old['id'])
+                else:
+                    self.add(product)
+
+    def prepare_load(self, snapshot):
+        """Index a new catalog off to the side; returns a callable that swaps it in"""
+        fresh = SearchIndex()
+        fresh.build(snapshot.products())
+
+        def install():
+            with self._lock:
+                self._postings = fresh._postings
+                self._terms = fresh._terms
+                self._doc_terms = fresh._doc_terms
+                self._doc_lengths = fresh._doc_lengths
+                self._total_length = fresh._total_length
+        return install
+
+    def build(self, products):
+        """Rebuild the whole index"""
+        with self._lock:
+            self._postings = {}
+            self._doc_terms = {}
+            self._doc_lengths = {}
+            self._total_length = 0
+            for product in products:
+                self._add(product)
+            self._terms = sorted(self._postings)
+
+    def add(self, product):
+        """Index a product, replacing any previous version of it"""
+        with self._lock:
+            self._remove(product['id'])
+            for term in self._add(product):
+                pos = bisect_left(self._terms, term)
+                if pos == len(self._terms) or self._terms[pos] != term:
+                    self._terms.insert(pos, term)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _add(self, product):
+        """Index a product and return the terms that were not indexed before"""
+        product_id = product['id']
+        frequencies = {}
+        tokens = product_tokens(product)
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        self._doc_lengths[product_id] = len(tokens)
+        self._total_length += len(tokens)
+        new_terms = []
+        for term, tf in frequencies.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = {}
+                new_terms.append(term)
+            posting[product_id] = tf
+        self._doc_terms[product_id] = frequencies
+        return new_terms
+
+    def _remove(self, product_id):
+        frequencies = self._doc_terms.pop(product_id, None)
+        self._total_length -= self._doc_lengths.pop(product_id, 0)
+        if not frequencies:
+            return
+        for term in frequencies:
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self._postings[term]
+                pos = bisect_left(self._terms, term)
+                if pos < len(self._terms) and self._terms[pos] == term:
+                    del self._terms[pos]
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def expand_prefix(self, prefix):
+        """Return all indexed terms starting with `prefix`"""
+        terms = []
+        pos = bisect_left(self._terms, prefix)
+        while pos < len(self._terms) and self._terms[pos].startswith(prefix):
+            terms.append(self._terms[pos])
+            pos += 1
+        return terms
+
+    def query_terms(self, query, prefix=True):
+        """Return one list of matching index terms per query token
+
+        The last token is treated as a prefix (when long enough) so that
+        partially typed words still match.
+        """
+        tokens = tokenize(query)
+        with self._lock:
+            expanded = []
+            for i, token in enumerate(tokens):
+                if prefix and i == len(tokens) - 1 and len(token) >= MIN_PREFIX_LENGTH:
+                    expanded.append(self.expand_prefix(token))
+                else:
+                    expanded.append([token] if token in self._postings else [])
+            return expanded
+
+    def search(self, query, prefix=True):
+        """Return the set of product ids containing every query token"""
+        expanded = self.query_terms(query, prefix=prefix)
+        if not expanded:
+            return set()
+        with self._lock:
+            matches = []
+            for terms in expanded:
+                ids = set()
+                for term in terms:
+                    ids.update(self._postings.get(term, ()))
+                matches.append(ids)
+        matches.sort(key=len)
+        result = matches[0]
+        for ids in matches[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    def bm25(self, query, ids, prefix=True):
+        """Return BM25 relevance scores for the given product ids
+
+        For a prefix-expanded token, the best-scoring expansion counts, so a
+        short prefix does not inflate documents that contain several words
+        sharing it.
+        """
+        expanded = self.query_terms(query, prefix=prefix)
+        scores = dict.fromkeys(ids, 0.0)
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if not n_docs or not scores:
+                return scores
+            avg_length = self._total_length / n_docs or 1.0
+            for terms in expanded:
+                best = {}
+                for term in terms:
+                    posting = self._postings.get(term)
+                    if not posting:
+                        continue
+                    idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                    # Walk whichever side is smaller
+                    if len(posting) < len(scores):
+                        pairs = ((i, tf) for i, tf in posting.items() if i in scores)
+                    else:
+                        pairs = ((i, posting[i]) for i in scores if i in posting)
+                    for product_id, tf in pairs:
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[product_id] / avg_length)
+                        value = idf * tf * (BM25_K1 + 1) / (tf + norm)
+                        if value > best.get(product_id, 0.0):
+                            best[product_id] = value
+                for product_id, value in best.items():
+                    scores[product_id] += value
+        return scores
@@ -0,0 +1,368 @@
+import bisect
+import queue
+import threading
+
+# Minimum score for a product to count as similar
+SIMILARITY_THRESHOLD = 30
+
+# Only products sharing one of these fields can reach the threshold
+CANDIDATE_FIELDS = ('category', 'style', 'brand')
+
+# Most similar products re-checked around a changed product
+MAX_CANDIDATES = 256
+
+# Batches changing more products than this rebuild the table instead
+MAX_INCREMENTAL_CHANGES = 400
+
+# Disjoint groups of products sharing the category (c), style (s) and/or
+# brand (b) of a product, best first, with their score before the price bonus
+TIERS = (('csb', 90), ('cs', 70), ('cb', 60), ('sb', 50), ('c', 40), ('s', 30), ('b', 20))
+PRICE_BONUS = 10
+
+
+def price_close(reference_price, price):
+    """Whether `price` is within 50% of a positive `reference_price`"""
+    return reference_price > 0 and abs(price - reference_price) / reference_price <= 0.5
+
+
+def similarity_score(reference_product, product):
+    """Score how similar `product` is to `reference_product` (0-100)"""
+    similarity_score = 0
+
+    # Same category
+    if product.get('category') == reference_product.get('category'):
+        similarity_score += 40
+
+    # Same style
+    if product.get('style') == reference_product.get('style'):
+        similarity_score += 30
+
+    # Same brand
+    if product.get('brand') == reference_product.get('brand'):
+        similarity_score += 20
+
+    # Similar price range (within 50% difference)
+    if price_close(reference_product.get('price', 0), product.get('price', 0)):
+        similarity_score += PRICE_BONUS
+
+    return similarity_score
+
+
+class CandidateTiers:
+    """The products sharing attributes with a product, split into TIERS
+
+    Tiers are built from the catalog postings on first use and cached, so
+    products with the same category, style and brand share one instance;
+    only their price, which picks the bonus within each tier, differs.
+    """
+
+    def __init__(self, catalog, product):
+        self.catalog = catalog
+        self.category = catalog.posting('category', product.get('category'))
+        self.style = catalog.posting('style', product.get('style'))
+        self.brand = catalog.posting('brand', product.get('brand'))
+        self._members = {}
+        self._sorted = {}
+        self._brand_prices = None
+
+    def members(self, name):
+        """Return the id set of one tier"""
+        ids = self._members.get(name)
+        if ids is None:
+            c, s, b = self.category, self.style, self.brand
+            if name in ('csb', 'cs'):
+                both = self.members('c&s')
+                ids = both & b if name == 'csb' else both - b
+            elif name == 'c&s':
+                ids = c & s
+            elif name == 'cb':
+                ids = (c & b) - s
+            elif name == 'sb':
+                ids = (s & b) - c
+            elif name == 'c':
+                ids = c - s - b
+            elif name == 's':
+                ids = s - c - b
+            else:
+                ids = b - c - s
+            self._members[name] = ids
+        return ids
+
+    def _sorted_ids(self, name):
+        ids = self._sorted.get(name)
+        if ids is None:
+            ids = self._sorted[name] = sorted(self.members(name))
+        return ids
+
+    def top(self, reference_product, limit, exclude=None):
+        """Return the best `limit` ``(score, id)`` pairs, best first
+
+        Exactly the products a full scan would rank first (ties by id):
+        each score level is the price-matching part of one tier plus the
+        rest of the tier above, and only the levels needed are read.
+        """
+        reference_price = reference_product.get('price', 0)
+        results = []
+        level = TIERS[0][1] + PRICE_BONUS
+        while level >= SIMILARITY_THRESHOLD and len(results) < limit:
+            need = limit - len(results)
+            found = []
+            for name, base in TIERS:
+                if base not in (level, level - PRICE_BONUS):
+                    continue
+                priced = base != level
+                taken = 0
+                for product_id in self._sorted_ids(name):
+                    if product_id == exclude:
+                        continue
+                    product = self.catalog.get(product_id)
+                    if price_close(reference_price, product.get('price', 0)) == priced:
+                        found.append((product_id, product))
+                        taken += 1
+                        if taken >= need:
+                            break
+            found.sort(key=lambda item: item[0])
+            results.extend((similarity_score(reference_product, product), product_id)
+                           for product_id, product in found[:need])
+            level -= PRICE_BONUS
+        results.sort(key=lambda item: (-item[0], item[1]))
+        return results
+
+    def total(self, reference_product, exclude=None):
+        """Count the products scoring at least SIMILARITY_THRESHOLD
+
+        Every product sharing the category or the style qualifies; of the
+        brand-only tier, the ones within the price range do.
+        """
+        count = len(self.category) + len(self.style) - len(self.members('c&s'))
+        if exclude in self.category or exclude in self.style:
+            count -= 1
+        if self._brand_prices is None:
+            self._brand_prices = sorted(self.catalog.get(i).get('price', 0) for i in self.members('b'))
+        prices = self._brand_prices
+        reference_price = reference_product.get('price', 0)
+        if reference_price > 0:
+            lo = bisect.bisect_left(prices, reference_price * 0.5)
+            hi = bisect.bisect_right(prices, reference_price * 1.5)
+            # Settle the float rounding at the range edges with price_close itself
+            while lo > 0 and price_close(reference_price, prices[lo - 1]):
+                lo -= 1
+            while lo < hi and not price_close(reference_price, prices[lo]):
+                lo += 1
+            while hi < len(prices) and price_close(reference_price, prices[hi]):
+                hi += 1
+            while hi > lo and not price_close(reference_price, prices[hi - 1]):
+                hi -= 1
+            count += hi - lo
+            if exclude in self.members('b'):
+                count -= 1
+        return count
+
+
+def candidate_ids(catalog, product, limit=MAX_CANDIDATES):
+    """Return the ids of the `limit` products most similar to `product`"""
+    tiers = CandidateTiers(catalog, product)
+    return {product_id for _, product_id in tiers.top(product, limit, exclude=product['id'])}
+
+
+def similar_count(catalog, product):
+    """Count the other products scoring at least SIMILARITY_THRESHOLD against `product`"""
+    return CandidateTiers(catalog, product).total(product, exclude=product['id'])
+
+
+class NeighborTable:
+    """Precomputed top-k similar products per product
+
+    Each entry is ``(neighbors, version)`` where `neighbors` is the exact
+    top-k list of ``(score, id)`` sorted best first and `version` is the
+    catalog version the entry reflects. Totals are counted at lookup time
+    from the postings, with the tiers of each attribute combination cached
+    for the current catalog version.
+
+    The table is built by a background thread after a catalog load,
+    replacing the previous table only once complete, and patched
+    incrementally after each batch of changes for the products most
+    similar to the changed ones, so a lookup is O(k). Entries that are missing (not built
+    yet, or invalidated) or list a product whose score has since changed
+    are computed on demand.
+    """
+
+    def __init__(self, catalog, k=6, max_cached_tiers=1024):
+        self.catalog = catalog
+        self.k = k
+        self.max_cached_tiers = max_cached_tiers
+        self._table = {}
+        self._sparse = set()  # ids whose entry lists fewer than k products
+        self._tiers = (None, {})  # (catalog version, {attributes: CandidateTiers})
+        self._lock = threading.Lock()
+        self._events = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Start the background maintenance thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='neighbor-table', daemon=True)
+            self._thread.start()
+
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener; queues the change for the background thread"""
+        self._events.put((event, changes, self.catalog.version))
+
+    def join(self):
+        """Block until all queued catalog changes have been applied"""
+        self._events.join()
+
+    def _run(self):
+        while True:
+            event, changes, version = self._events.get()
+            try:
+                if event == 'load' or len(changes) > MAX_INCREMENTAL_CHANGES:
+                    self._rebuild()
+                else:
+                    self._apply(changes, version)
+            except Exception:
+                # Fall back to on-demand computation rather than serve stale rows
+                with self._lock:
+                    self._table.clear()
+                    self._sparse.clear()
+            finally:
+                self._events.task_done()
+
+    def _store(self, product_id, entry):
+        # Called with the lock held
+        self._table[product_id] = entry
+        if len(entry[0]) < self.k:
+            self._sparse.add(product_id)
+        else:
+            self._sparse.discard(product_id)
+
+    def _drop(self, product_id):
+        # Called with the lock held
+        self._table.pop(product_id, None)
+        self._sparse.discard(product_id)
+
+    def _tiers_for(self, snapshot, product):
+        """Return the (shared) CandidateTiers of a product in a snapshot"""
+        version, cache = self._tiers
+        if version != snapshot.version or len(cache) >= self.max_cached_tiers:
+            cache = {}
+            self._tiers = (snapshot.version, cache)
+        key = tuple(product.get(field) for field in CANDIDATE_FIELDS)
+        tiers = cache.get(key)
+        if tiers is None:
+            tiers = cache[key] = CandidateTiers(snapshot, product)
+        return tiers
+
+    def _rebuild(self):
+        # Build against one snapshot and keep serving the old table meanwhile;
+        # products with the same attributes share their tiers
+        snapshot = self.catalog.snapshot()
+        groups = {}
+        for product in snapshot.products():
+            groups.setdefault(tuple(product.get(field) for field in CANDIDATE_FIELDS), []).append(product)
+        table = {}
+        sparse = set()
+        for products in groups.values():
+            tiers = CandidateTiers(snapshot, products[0])
+            for product in products:
+                neighbors = tiers.top(product, self.k, exclude=product['id'])
+                table[product['id']] = (neighbors, snapshot.version)
+                if len(neighbors) < self.k:
+                    sparse.add(product['id'])
+        with self._lock:
+            self._table = table
+            self._sparse = sparse
+
+    def compute(self, reference_product, catalog=None):
+        """Compute the neighbor entry of one product from the catalog (or a snapshot)"""
+        if catalog is None:
+            catalog = self.catalog.snapshot()
+        tiers = self._tiers_for(catalog, reference_product)
+        return tiers.top(reference_product, self.k, exclude=reference_product['id']), catalog.version
+
+    def _apply(self, changes, version):
+        """Patch the table after a batch of ``(product, old)`` changes (product None when removed)"""
+        changed = {}  # id -> product after the batch, or None
+        snapshot = self.catalog.snapshot()
+        # The most similar products, the whole top tier (it may exceed the
+        # candidate cap) and every entry short of k neighbors may list them
+        affected = set()
+        top_tiers = set()
+        for product, old in changes:
+            changed_id = (product or old)['id']
+            changed[changed_id] = product
+            for reference in (old, product):
+                if reference is not None:
+                    tiers = self._tiers_for(snapshot, reference)
+                    affected |= {i for _, i in tiers.top(reference, MAX_CANDIDATES, exclude=changed_id)}
+                    top_tiers.add(tiers)
+        for tiers in top_tiers:
+            affected |= tiers.members('csb')
+        with self._lock:
+            affected |= self._sparse
+            affected -= changed.keys()
+            for changed_id in changed:
+                entry = self._table.get(changed_id)
+                if entry is not None and entry[1] < version:
+                    self._drop(changed_id)
+            for other_id in affected:
+                entry = self._table.get(other_id)
+                other = snapshot.get(other_id)
+                if entry is None or other is None:
+                    continue
+                neighbors, entry_version = entry
+                if entry_version >= version:
+                    continue  # computed after this batch
+                neighbors = self._patched(other, neighbors, changed)
+                if neighbors is None:
+                    # An unlisted product may now outrank one; recompute lazily
+                    self._drop(other_id)
+                else:
+                    self._store(other_id, (neighbors, version))
+
+    def _patched(self, other, neighbors, changed):
+        """Return `other`'s neighbors after the changes, or None if they must be recomputed"""
+        for changed_id, product in changed.items():
+            new_score = similarity_score(other, product) if product is not None else 0
+            listed = [item for item in neighbors if item[1] != changed_id]
+            if len(listed) < len(neighbors) and len(neighbors) >= self.k:
+                old_score = neighbors[[item[1] for item in neighbors].index(changed_id)][0]
+                if new_score < old_score:
+                    return None
+            if new_score >= SIMILARITY_THRESHOLD:
+                listed.append((new_score, changed_id))
+                listed.sort(key=lambda item: (-item[0], item[1]))
+                listed = listed[:self.k]
+            neighbors = listed
+        return neighbors
+
+    def neighbors(self, product_id):
+        """Return ``([(product, score), ...], total)`` for a product, or None
+
+        `total` is the exact number of products scoring at least
+        SIMILARITY_THRESHOLD.
+        """
+        snapshot = self.catalog.snapshot()
+        reference_product = snapshot.get(product_id)
+        if reference_product is None:
+            return None
+        total = self._tiers_for(snapshot, reference_product).total(reference_product, exclude=product_id)
+        entry = self._table.get(product_id)
+        if entry is not None:
+            results = []
+            for score, neighbor_id in entry[0]:
+                product = snapshot.get(neighbor_id)
+                if product is None:
+                    continue
+                if similarity_score(reference_product, product) != score:
+                    entry = None  # a listed product changed outside the patched candidates
+                    break
+                results.append((product, score))
+            if entry is not None:
+                return results, total
+        neighbors, version = entry = self.compute(reference_product, snapshot)
+        with self._lock:
+            current = self._table.get(product_id)
+            if current is None or current[1] <= version:
+                self._store(product_id, entry)
+        return [(snapshot.get(neighbor_id), score) for score, neighbor_id in neighbors], total
@@ -0,0 +1,350 @@
+from array import array
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+
+_HEADER = struct.Struct('<4sIIQQ')  # magic, width, depth, seed, total
+_MAGIC = b'CMS1'
+
+
+def _hash64(key, seed):
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8,
+                             key=seed.to_bytes(8, 'little')).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class CountMinSketch:
+    """Count-Min Sketch: fixed-memory frequency estimates that never undercount
+
+    Uses ``width * depth`` 64-bit counters. With width ``w`` and depth
+    ``d`` an estimate exceeds the true count by more than ``2N / w`` with
+    probability at most ``2**-d`` (N = total count). Sketches with the
+    same shape and seed can be merged by adding their tables, so workers
+    can count independently and combine their results.
+    """
+
+    def __init__(self, width=2048, depth=4, seed=0):
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        self.total = 0
+        self._table = array('Q', bytes(8 * width * depth))
+
+    def _cells(self, key):
+        # Kirsch-Mitzenmacher: derive `depth` hashes from one 64-bit hash
+        h = _hash64(key, self.seed)
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        table = self._table
+        for cell in self._cells(key):
+            table[cell] += count
+        self.total += count
+
+    def estimate(self, key):
+        table = self._table
+        return min(table[cell] for cell in self._cells(key))
+
+    def merge(self, other):
+        """Add another sketch's counts into this one"""
+        if (other.width, other.depth, other.seed) != (self.width, self.depth, self.seed):
+            raise ValueError("Count-Min sketches must share width, depth and seed to merge")
+        table = self._table
+        for i, value in enumerate(other._table):
+            if value:
+                table[i] += value
+        self.total += other.total
+
+    def to_bytes(self):
+        return _HEADER.pack(_MAGIC, self.width, self.depth, self.seed, self.total) + self._table.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, width, depth, seed, total = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a serialized Count-Min sketch")
+        sketch = cls(width=width, depth=depth, seed=seed)
+        sketch._table = array('Q')
+        sketch._table.frombytes(data[_HEADER.size:])
+        sketch.total = total
+        return sketch
+
+
+class SpaceSaving:
+    """Space-Saving heavy hitters: the top keys in `capacity` counters
+
+    Each monitored key has a count and the maximum overestimation
+    (`error`) it inherited when it replaced the smallest counter.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._counts = {}  # key -> [count, error]
+
+    def add(self, key, count=1):
+        entry = self._counts.get(key)
+        if entry is not None:
+            entry[0] += count
+        elif len(self._counts) < self.capacity:
+            self._counts[key] = [count, 0]
+        else:
+            victim = min(self._counts, key=lambda k: self._counts[k][0])
+            floor = self._counts.pop(victim)[0]
+            self._counts[key] = [floor + count, floor]
+
+    def _floor(self):
+        if len(self._counts) < self.capacity:
+            return 0
+        return min(entry[0] for entry in self._counts.values())
+
+    def merge(self, other):
+        """Merge another summary (mergeable summaries, Agarwal et al.)"""
+        floor, other_floor = self._floor(), other._floor()
+        merged = {}
+        for key in set(self._counts) | set(other._counts):
+            count, error = self._counts.get(key, (floor, floor))
+            other_count, other_error = other._counts.get(key, (other_floor, other_floor))
+            merged[key] = [count + other_count, error + other_error]
+        best = sorted(merged.items(), key=lambda item: -item[1][0])[:self.capacity]
+        self._counts = dict(best)
+
+    def top(self, n=None):
+        """Return ``[(key, count, error), ...]`` by count, highest first"""
+        ranked = sorted(self._counts.items(), key=lambda item: -item[1][0])
+        if n is not None:
+            ranked = ranked[:n]
+        return [(key, count, error) for key, (count, error) in ranked]
+
+
+class HeavyHitters:
+    """Count-Min Sketch for any key plus a Space-Saving list of the top keys"""
+
+    def __init__(self, width=2048, depth=4, capacity=100, seed=0):
+        self.sketch = CountMinSketch(width=width, depth=depth, seed=seed)
+        self.top_keys = SpaceSaving(capacity=capacity)
+        self._lock = threading.Lock()
+
+    def add(self, key, count=1):
+        with self._lock:
+            self.sketch.add(key, count)
+            self.top_keys.add(key, count)
+
+    def estimate(self, key):
+        with self._lock:
+            return self.sketch.estimate(key)
+
+    def top(self, n=10):
+        """Return the heaviest ``[(key, estimated_count), ...]``
+
+        Both structures overestimate, so the smaller of the two is used.
+        """
+        with self._lock:
+            return [
+                (key, min(count, self.sketch.estimate(key)))
+                for key, count, _ in self.top_keys.top(n)
+            ]
+
+    def merge(self, other):
+        with self._lock:
+            self.sketch.merge(other.sketch)
+            self.top_keys.merge(other.top_keys)
+
+    def to_bytes(self):
+        """Serialize for shipping to another process"""
+        with self._lock:
+            sketch = self.sketch.to_bytes()
+            top_keys = json.dumps({
+                "capacity": self.top_keys.capacity,
+                "counts": [[key, count, error] for key, count, error in self.top_keys.top()]
+            }).encode('utf-8')
+        return struct.pack('<Q', len(sketch)) + sketch + top_keys
+
+    @classmethod
+    def from_bytes(cls, data):
+        (sketch_length,) = struct.unpack_from('<Q', data)
+        sketch = CountMinSketch.from_bytes(data[8:8 + sketch_length])
+        top_keys = json.loads(data[8 + sketch_length:].decode('utf-8'))
+        counter = cls(width=sketch.width, depth=sketch.depth, capacity=top_keys['capacity'], seed=sketch.seed)
+        counter.sketch = sketch
+        counter.top_keys._counts = {key: [count, error] for key, count, error in top_keys['counts']}
+        return counter
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by another user
+    return True
+
+
+class SharedCounter:
+    """A worker's own HeavyHitters plus the last exported counts of its peers
+
+    Adds go to the local counter; reads sum both, so a worker sees its own
+    events at once and the other workers' as of their last export.
+    """
+
+    def __init__(self, local, peers=None):
+        self.local = local
+        self.peers = peers
+
+    def add(self, key, count=1):
+        self.local.add(key, count)
+
+    def estimate(self, key):
+        estimate = self.local.estimate(key)
+        if self.peers is not None:
+            estimate += self.peers.estimate(key)
+        return estimate
+
+    def top(self, n=10):
+        if self.peers is None:
+            return self.local.top(n)
+        local, peers = dict(self.local.top(n)), dict(self.peers.top(n))
+        counts = {
+            key: (local[key] if key in local else self.local.estimate(key))
+            + (peers[key] if key in peers else self.peers.estimate(key))
+            for key in local.keys() | peers.keys()
+        }
+        return sorted(counts.items(), key=lambda item: -item[1])[:n]
+
+
+class SketchRegistry:
+    """Named HeavyHitters counters sharing one memory configuration
+
+    Every counter uses ``width * depth * 8`` bytes plus `capacity`
+    heavy-hitter slots, however many distinct keys it sees.
+
+    Counters live in each worker process. After `share(directory)` every
+    worker exports its named counters there periodically and `get` returns
+    views that add the other workers' exports, so counts cover the whole
+    deployment. Exports of workers that have exited are folded into the
+    next worker that syncs. Counters from `new_counter` stay per worker;
+    `discard` drops a named counter that is no longer needed.
+    """
+
+    def __init__(self, width=2048, depth=4, capacity=100, seed=0):
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.seed = seed
+        self._counters = {}
+        self._peers = {}  # name -> merged counters exported by other workers
+        self._lock = threading.Lock()
+        self._share_dir = None
+        self._share_thread = None
+
+    def _local(self, name):
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = self.new_counter()
+            return counter
+
+    def get(self, name):
+        return SharedCounter(self._local(name), self._peers.get(name))
+
+    def find(self, name):
+        """Like `get`, but returns None instead of creating an unused counter"""
+        with self._lock:
+            local = self._counters.get(name)
+        peers = self._peers.get(name)
+        if local is None and peers is None:
+            return None
+        return SharedCounter(local if local is not None else self.new_counter(), peers)
+
+    def names(self):
+        """Return the names of this worker's counters"""
+        with self._lock:
+            return list(self._counters)
+
+    def discard(self, name):
+        """Drop a counter (e.g. an expired time slot) and this worker's export of it"""
+        with self._lock:
+            self._counters.pop(name, None)
+        self._peers.pop(name, None)
+        if self._share_dir is not None:
+            name_dir = os.path.join(self._share_dir, name)
+            try:
+                os.unlink(os.path.join(name_dir, f"{os.getpid()}.bin"))
+                os.rmdir(name_dir)
+            except OSError:
+                pass  # not exported yet, or other workers still export it
+
+    def new_counter(self):
+        return HeavyHitters(width=self.width, depth=self.depth, capacity=self.capacity, seed=self.seed)
+
+    def merge(self, other):
+        """Fold another registry (e.g. from another worker) into this one"""
+        for name, counter in list(other._counters.items()):
+            self._local(name).merge(counter)
+
+    def share(self, directory, interval=5.0):
+        """Sync counters through `directory` every `interval` seconds in a background thread"""
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._share_dir = directory
+
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except (OSError, ValueError):
+                    pass  # try again next round
+                time.sleep(interval)
+
+        if self._share_thread is None:
+            self._share_thread = threading.Thread(target=run, name='sketch-share', daemon=True)
+            self._share_thread.start()
+
+    def sync(self):
+        """Export this worker's counters and reload the other workers' exports"""
+        directory = self._share_dir
+        own = f"{os.getpid()}.bin"
+        with self._lock:
+            counters = dict(self._counters)
+        for name, counter in counters.items():
+            name_dir = os.path.join(directory, name)
+            os.makedirs(name_dir, mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=name_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(counter.to_bytes())
+            os.replace(tmp_path, os.path.join(name_dir, own))
+
+        peers = {}
+        for name in os.listdir(directory):
+            name_dir = os.path.join(directory, name)
+            for filename in os.listdir(name_dir):
+                if filename == own or not filename.endswith('.bin'):
+                    continue
+                path = os.path.join(name_dir, filename)
+                pid = int(filename[:-len('.bin')])
+                if not _process_alive(pid):
+                    # Claim a finished worker's export so only one survivor adopts it
+                    claimed = f"{path}.{os.getpid()}.adopt"
+                    try:
+                        os.rename(path, claimed)
+                    except FileNotFoundError:
+                        continue
+                    with open(claimed, 'rb') as f:
+                        self._local(name).merge(HeavyHitters.from_bytes(f.read()))
+                    os.unlink(claimed)
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        counter = HeavyHitters.from_bytes(f.read())
+                except FileNotFoundError:
+                    continue
+                if name in peers:
+                    peers[name].merge(counter)
+                else:
+                    peers[name] = counter
+        self._peers = peers
@@ -0,0 +1,293 @@
+import logging
+import threading
+import time
+from itertools import islice
+
+from sqlalchemy import delete, func, insert, select, update
+
+from src.models.product import CatalogChange, Product
+from src.models.user import db
+from src.services.records import ProductRecord
+
+logger = logging.getLogger(__name__)
+
+# Columns that accept equality filters
+FILTER_COLUMNS = {
+    'category': Product.category,
+    'brand': Product.brand,
+    'style': Product.style,
+    'color': Product.color
+}
+
+# Product keys that map to table columns
+PRODUCT_COLUMNS = tuple(column.key for column in Product.__table__.columns)
+
+# Change log rows kept for workers that fall behind; older ones are pruned
+CHANGE_LOG_SIZE = 100000
+
+# Change log rows read per query while catching up
+CHANGE_BATCH_SIZE = 5000
+
+# Recently seen change ids read again on every poll, so a transaction that
+# commits after one with a higher id is not missed
+CHANGE_LOOKBACK = 1000
+
+
+class SqlCatalog:
+    """SQL-backed product catalog with filter pushdown and bulk loading
+
+    Mirrors the read interface of CatalogStore (`page`, `count`,
+    `facet_counts`, `get`, `products`) so routes can use either backend.
+    Writes also log the changed product ids for CatalogSync. All methods
+    need an application context.
+    """
+
+    def _where(self, statement, min_price=None, max_price=None, **equals):
+        for field, value in equals.items():
+            if value is None:
+                continue
+            if field not in FILTER_COLUMNS:
+                raise ValueError(f"Unsupported filter field: {field}")
+            statement = statement.where(FILTER_COLUMNS[field] == value)
+        if min_price is not None:
+            statement = statement.where(Product.price >= min_price)
+        if max_price is not None:
+            statement = statement.where(Product.price <= max_price)
+        return statement
+
+    def get(self, product_id):
+        product = db.session.get(Product, product_id)
+        return product.to_dict() if product else None
+
+    def products(self, batch_size=10000):
+        """Yield every product as a dict, streaming in id order"""
+        statement = select(Product).order_by(Product.id).execution_options(yield_per=batch_size)
+        for product in db.session.scalars(statement):
+            yield product.to_dict()
+
+    def count(self, min_price=None, max_price=None, **equals):
+        statement = self._where(select(func.count()).select_from(Product),
+                                min_price=min_price, max_price=max_price, **equals)
+        return db.session.scalar(statement)
+
+    def page(self, limit, after_id=None, min_price=None, max_price=None, **equals):
+        """Return ``(products, total, has_more)`` for one keyset page
+
+        Filters, the cursor and the limit are pushed down into the
+        WHERE/ORDER BY/LIMIT clauses of an indexed query; the total is a
+        COUNT(*) over the same WHERE clause.
+        """
+        statement = self._where(select(Product), min_price=min_price, max_price=max_price, **equals)
+        if after_id is not None:
+            statement = statement.where(Product.id > after_id)
+        statement = statement.order_by(Product.id).limit(limit + 1)
+        rows = db.session.scalars(statement).all()
+        total = self.count(min_price=min_price, max_price=max_price, **equals)
+        return [row.to_dict() for row in rows[:limit]], total, len(rows) > limit
+
+    def facet_counts(self, min_price=None, max_price=None, **equals):
+        """Return ``{field: {value: count}}`` with one GROUP BY per field"""
+        counts = {}
+        for field, column in FILTER_COLUMNS.items():
+            statement = self._where(select(column, func.count()).group_by(column),
+                                    min_price=min_price, max_price=max_price, **equals)
+            counts[field] = {value: count for value, count in db.session.execute(statement) if value is not None}
+        return counts
+
+    def bulk_load(self, products, batch_size=5000, replace=True):
+        """Insert products in executemany batches, returning the row count
+
+        With `replace`, existing rows with the same ids are deleted first
+        in each batch, so re-importing a feed updates it in place.
+        """
+        loaded = 0
+        products = iter(products)
+        while True:
+            batch = [
+                {column: product.get(column) for column in PRODUCT_COLUMNS}
+                for product in islice(products, batch_size)
+            ]
+            if not batch:
+                break
+            for row in batch:
+                if row['price'] is None:
+                    row['price'] = 0
+            if replace:
+                db.session.execute(delete(Product).where(Product.id.in_([row['id'] for row in batch])))
+            db.session.execute(insert(Product), batch)
+            self._log_changes(row['id'] for row in batch)
+            db.session.commit()
+            loaded += len(batch)
+        return loaded
+
+    def apply(self, deltas, after_commit=None):
+        """Apply catalog deltas (see CatalogStore.apply) in one transaction
+
+        Patching a product that does not exist raises KeyError and rolls
+        the whole batch back. `after_commit()` runs once the transaction
+        has committed, e.g. to publish the same deltas in memory; returns
+        its result.
+        """
+        try:
+            changed = []
+            for delta in deltas:
+                op = delta[0]
+                if op == 'upsert':
+                    row = {column: delta[1].get(column) for column in PRODUCT_COLUMNS}
+                    if row['price'] is None:
+                        row['price'] = 0
+                    db.session.execute(delete(Product).where(Product.id == row['id']))
+                    db.session.execute(insert(Product), [row])
+                    changed.append(row['id'])
+                elif op == 'patch':
+                    values = {k: v for k, v in delta[2].items() if k in PRODUCT_COLUMNS and k != 'id'}
+                    if values:
+                        matched = db.session.execute(
+                            update(Product).where(Product.id == delta[1]).values(**values)).rowcount
+                        changed.append(delta[1])
+                    else:
+                        matched = db.session.execute(
+                            select(func.count()).select_from(Product).where(Product.id == delta[1])).scalar()
+                    if not matched:
+                        raise KeyError(delta[1])
+                elif op == 'remove':
+                    db.session.execute(delete(Product).where(Product.id == delta[1]))
+                    changed.append(delta[1])
+                else:
+                    raise ValueError(f"Unknown catalog delta: {op}")
+            self._log_changes(changed)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return after_commit() if after_commit is not None else None
+
+    # ------------------------------------------------------------------
+    # Change log
+    # ------------------------------------------------------------------
+    def _log_changes(self, product_ids):
+        # Runs inside the writer's transaction, so the log commits with the rows
+        rows = [{'product_id': product_id} for product_id in product_ids]
+        if rows:
+            db.session.execute(insert(CatalogChange), rows)
+
+    def version(self):
+        """Return the id of the latest change log row, or 0"""
+        return db.session.scalar(select(func.max(CatalogChange.id))) or 0
+
+    def changes(self, after, limit=CHANGE_BATCH_SIZE):
+        """Return up to `limit` ``(version, product_id)`` pairs logged after `after`"""
+        statement = (select(CatalogChange.id, CatalogChange.product_id)
+                     .where(CatalogChange.id > after).order_by(CatalogChange.id).limit(limit))
+        return db.session.execute(statement).all()
+
+    def oldest_change(self):
+        """Return the id of the oldest change log row still kept, or None"""
+        return db.session.scalar(select(func.min(CatalogChange.id)))
+
+    def get_many(self, product_ids):
+        """Return ``{id: product dict}`` for the given ids that exist"""
+        statement = select(Product).where(Product.id.in_(product_ids))
+        return {product.id: product.to_dict() for product in db.session.scalars(statement)}
+
+    def prune_changes(self, keep=CHANGE_LOG_SIZE):
+        """Delete all but the latest `keep` change log rows"""
+        cutoff = self.version() - keep
+        if cutoff > 0:
+            db.session.execute(delete(CatalogChange).where(CatalogChange.id <= cutoff))
+            db.session.commit()
+
+
+class CatalogSync:
+    """Keeps a worker's in-memory catalog in step with the SQL catalog
+
+    Every write to SqlCatalog also logs the changed product ids in the
+    ``catalog_changes`` table, in the same transaction. Each worker polls
+    that log every `interval` seconds from a background thread and applies
+    the changed rows to its CatalogStore as upserts and removals, skipping
+    rows it already holds (such as its own writes). A worker that fell
+    behind the pruned log reloads the whole catalog instead.
+    """
+
+    def __init__(self, app, sql_catalog, catalog, interval=1.0, prune_interval=300):
+        self.app = app
+        self.sql_catalog = sql_catalog
+        self.catalog = catalog
+        self.interval = interval
+        self.prune_interval = prune_interval
+        self.version = 0  # latest change log id applied
+        self._seen = set()  # applied change ids within CHANGE_LOOKBACK of `version`
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load(self):
+        """Load the whole catalog from the database; needs an application context"""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        # Read the version first: changes committed during the load are
+        # applied again by the next poll, which is harmless
+        version = self.sql_catalog.version()
+        self.catalog.load(self.sql_catalog.products())
+        self.version = version
+        self._seen = set()
+
+    def start(self):
+        """Start the background polling thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalog-sync', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        pruned_at = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.poll()
+                    if time.monotonic() - pruned_at >= self.prune_interval:
+                        self.sql_catalog.prune_changes()
+                        pruned_at = time.monotonic()
+            except Exception:
+                # The database may be briefly unavailable; try again next round
+                logger.exception("Catalog sync failed")
+
+    def poll(self):
+        """Apply the changes logged since the last poll; returns the number applied"""
+        with self._lock:
+            oldest = self.sql_catalog.oldest_change()
+            if oldest is not None and oldest > self.version + 1:
+                self._load()  # the changes we missed were pruned
+                return 0
+            applied = 0
+            while True:
+                rows = self.sql_catalog.changes(self.version - CHANGE_LOOKBACK, CHANGE_LOOKBACK + CHANGE_BATCH_SIZE)
+                fresh = [(change_id, product_id) for change_id, product_id in rows if change_id not in self._seen]
+                if fresh:
+                    applied += self._apply({product_id for _, product_id in fresh})
+                    self._seen.update(change_id for change_id, _ in fresh)
+                    self.version = max(self.version, fresh[-1][0])
+                    floor = self.version - CHANGE_LOOKBACK
+                    self._seen = {change_id for change_id in self._seen if change_id > floor}
+                if len(rows) < CHANGE_LOOKBACK + CHANGE_BATCH_SIZE:
+                    break
+            return applied
+
+    def refresh(self, product_ids):
+        """Copy the given products' database rows to the in-memory catalog; needs an application context"""
+        with self._lock:
+            return self._apply(set(product_ids))
+
+    def _apply(self, product_ids):
+        rows = self.sql_catalog.get_many(list(product_ids))
+        deltas = []
+        for product_id in product_ids:
+            row = rows.get(product_id)
+            current = self.catalog.get(product_id)
+            if row is None:
+                if current is not None:
+                    deltas.append(('remove', product_id))
+            elif current is None or current != ProductRecord(row):
+                deltas.append(('upsert', row))
+        return self.catalog.apply(deltas) if deltas else 0
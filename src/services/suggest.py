@@ -0,0 +1,144 @@
+from bisect import bisect_left
+import heapq
+import threading
+import time
+
+from src.services.cache import TTLCache
+from src.services.search_index import normalize_text
+
+# Product fields offered as suggestions, with the suggestion type
+SUGGEST_FIELDS = (
+    ('title', 'product'),
+    ('brand', 'brand'),
+    ('category', 'category'),
+    ('tags', 'tag')
+)
+
+
+# Product fields that change the suggestions: the suggested fields plus
+# the review count, which weights their popularity
+SOURCE_FIELDS = tuple(field for field, _ in SUGGEST_FIELDS) + ('reviews',)
+
+
+class SuggestIndex:
+    """Prefix autocomplete over titles, brands, categories and tags
+
+    Suggestions live in a sorted array of normalized keys; a prefix maps
+    to a contiguous range found with bisect, and the most popular entries
+    of that range are returned. Results are memoized per prefix.
+
+    Catalog changes that touch SOURCE_FIELDS schedule a rebuild on a
+    background thread (at most one every `rebuild_interval` seconds);
+    lookups keep using the current arrays until the new ones are swapped
+    in, so a keystroke never waits for a rebuild. Price or stock patches
+    leave the suggestions alone.
+    """
+
+    def __init__(self, catalog, rebuild_interval=5.0, memo_size=4096):
+        self.catalog = catalog
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        # (generation, sorted keys, aligned (text, type, popularity) entries)
+        self._data = (0, [], [])
+        self._version = 0  # catalog version the arrays were built from
+        self._dirty = False
+        self._rebuilding = False
+        self._built_at = 0.0
+        self._memo = TTLCache(maxsize=memo_size)
+
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener; schedules a rebuild when suggested fields change"""
+        if event == 'apply' and all(
+                product is not None and old is not None
+                and all(product.get(field) == old.get(field) for field in SOURCE_FIELDS)
+                for product, old in changes):
+            return
+        self._schedule_rebuild()
+
+    def _schedule_rebuild(self):
+        with self._lock:
+            self._dirty = True
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._run_rebuilds, name='suggest-index', daemon=True).start()
+
+    def _run_rebuilds(self):
+        while True:
+            wait = self.rebuild_interval - (time.monotonic() - self._built_at)
+            if wait > 0:
+                time.sleep(wait)
+            with self._lock:
+                if not self._dirty:
+                    self._rebuilding = False
+                    return
+                # Clear first so changes made during the rebuild trigger another one
+                self._dirty = False
+            snapshot = self.catalog.snapshot()
+            try:
+                keys, entries = self._build(snapshot.products())
+            except Exception:
+                keys = None  # keep serving the current arrays
+            with self._lock:
+                if keys is not None:
+                    self._install(snapshot.version, keys, entries)
+                self._built_at = time.monotonic()
+
+    def _build(self, products):
+        """Return the sorted keys and aligned entries for the given products"""
+        popularity = {}
+        for product in products:
+            weight = product.get('reviews', 0) or 1
+            for field, kind in SUGGEST_FIELDS:
+                values = product.get(field)
+                if not values:
+                    continue
+                if not isinstance(values, (list, tuple)):
+                    values = (values,)
+                for value in values:
+                    key = (normalize_text(value), kind)
+                    text, total = popularity.get(key, (value, 0))
+                    popularity[key] = (text, total + weight)
+
+        items = sorted(
+            (normalized, (text, kind, total))
+            for (normalized, kind), (text, total) in popularity.items()
+        )
+        return [normalized for normalized, _ in items], [entry for _, entry in items]
+
+    def _install(self, version, keys, entries):
+        # A rebuild that started before a catalog load must not replace its result
+        if version >= self._version:
+            self._version = version
+            self._data = (self._data[0] + 1, keys, entries)
+
+    def prepare_load(self, snapshot):
+        """Build suggestions for a new catalog off to the side; returns a callable that swaps them in"""
+        keys, entries = self._build(snapshot.products())
+
+        def install():
+            with self._lock:
+                self._install(snapshot.version, keys, entries)
+        return install
+
+    def suggest(self, prefix, limit=8):
+        """Return up to `limit` suggestions starting with `prefix`, most popular first"""
+        prefix = normalize_text(prefix).strip()
+        if not prefix:
+            return []
+        generation, keys, entries = self._data
+
+        memo_key = (prefix, limit)
+        cached = self._memo.get(memo_key, tag=generation)
+        if cached is not None:
+            return cached
+
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        best = heapq.nlargest(limit, range(start, end), key=lambda i: entries[i][2])
+        suggestions = [
+            {"text": entries[i][0], "type": entries[i][1], "popularity": entries[i][2]}
+            for i in best
+        ]
+        self._memo.set(memo_key, suggestions, tag=generation)
+        return suggestions
@@ -0,0 +1,149 @@
+import threading
+import time
+from datetime import date
+
+from src.services.sketch import SketchRegistry
+
+# Weight of each engagement event in the trending score
+EVENT_WEIGHTS = {
+    'view': 1,
+    'click': 3,
+    'purchase': 10
+}
+
+# Registry counter names: one per time slot and one per day
+SLOT_COUNTER_PREFIX = 'trending-slot-'
+DAILY_COUNTER_PREFIX = 'trending-day-'
+
+
+class TrendingTracker:
+    """Time-decayed engagement scores kept in named registry counters
+
+    Weighted events are counted in one HeavyHitters counter per
+    `slot_seconds` time slot. A product's score sums its counts in the
+    slots of the last `retention` half-lives, each decayed by
+    ``2**(-age / half_life)`` from the middle of its slot, so scores decay
+    in steps of one slot. When the registry is shared across workers
+    (`SketchRegistry.share`), every worker counts into the same named
+    counters and ranks the whole deployment's events.
+
+    The ranking is built from the heavy-hitter keys of each slot (a key
+    outside a slot's heavy hitters counts as zero there) and cached for
+    `refresh` seconds, about as often as peers export their counts.
+    Daily per-product (and per-region) event counts use one counter per
+    day. Expired slot and day counters are dropped from the registry.
+    """
+
+    def __init__(self, counters=None, half_life=6 * 3600, top_k=50, clock=time.time,
+                 slot_seconds=None, retention=5, refresh=5.0):
+        self.counters = counters if counters is not None else SketchRegistry()
+        self.half_life = half_life
+        self.top_k = top_k
+        self.clock = clock
+        self.slot_seconds = slot_seconds or half_life / 3
+        self.slots = int(retention * half_life / self.slot_seconds)
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._current_slot = None
+        self._cached = (None, [], {})  # (built at, ranking, scores)
+
+    def _slot(self, now):
+        return int(now // self.slot_seconds)
+
+    def record(self, product_id, event_type, count=1, region=None):
+        """Record `count` events of `event_type` for a product"""
+        now = self.clock()
+        slot = self._slot(now)
+        if slot != self._current_slot:
+            self._expire(slot, now)
+        self.counters.get(f'{SLOT_COUNTER_PREFIX}{slot}').add(product_id, EVENT_WEIGHTS[event_type] * count)
+        daily = self.counters.get(_daily_name(now))
+        daily.add(_daily_key(product_id, event_type), count)
+        if region:
+            daily.add(_daily_key(product_id, event_type, region), count)
+
+    def _expire(self, slot, now):
+        with self._lock:
+            if slot == self._current_slot:
+                return
+            self._current_slot = slot
+        today = _daily_name(now)
+        for name in self.counters.names():
+            if name.startswith(SLOT_COUNTER_PREFIX):
+                if int(name[len(SLOT_COUNTER_PREFIX):]) <= slot - self.slots:
+                    self.counters.discard(name)
+            elif name.startswith(DAILY_COUNTER_PREFIX) and name != today:
+                self.counters.discard(name)
+
+    def _slot_weights(self, now):
+        """Yield ``(counter, decay)`` for every live slot with events"""
+        slot = self._slot(now)
+        for past in range(slot - self.slots + 1, slot + 1):
+            counter = self.counters.find(f'{SLOT_COUNTER_PREFIX}{past}')
+            if counter is not None:
+                middle = (past + 0.5) * self.slot_seconds
+                yield counter, 2 ** (-max(now - middle, 0.0) / self.half_life)
+
+    def _build(self, now):
+        scores = {}
+        for counter, decay in self._slot_weights(now):
+            for product_id, count in counter.top(self.counters.capacity):
+                scores[product_id] = scores.get(product_id, 0.0) + count * decay
+        ranking = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:self.top_k]
+        return now, ranking, scores
+
+    def _snapshot(self):
+        now = self.clock()
+        cached = self._cached
+        if cached[0] is None or now - cached[0] >= self.refresh:
+            cached = self._cached = self._build(now)
+        return now, cached
+
+    def top(self, limit=None):
+        """Return ``[(product_id, decayed_score), ...]`` best first"""
+        now, (built_at, ranking, _) = self._snapshot()
+        decay = 2 ** (-(now - built_at) / self.half_life)
+        ranking = ranking if limit is None else ranking[:limit]
+        return [(product_id, score * decay) for product_id, score in ranking]
+
+    def scores(self):
+        """Return ``{product_id: decayed_score}`` for the products with notable engagement"""
+        now, (built_at, _, scores) = self._snapshot()
+        decay = 2 ** (-(now - built_at) / self.half_life)
+        return {product_id: score * decay for product_id, score in scores.items()}
+
+    def today(self, product_id, event_type, region=None):
+        """Return today's (estimated) count of `event_type` events for a product"""
+        daily = self.counters.find(_daily_name(self.clock()))
+        return daily.estimate(_daily_key(product_id, event_type, region)) if daily is not None else 0
+
+    def score(self, product_id):
+        """Return the current decayed score of a product"""
+        return sum(counter.estimate(product_id) * decay for counter, decay in self._slot_weights(self.clock()))
+
+
+def _daily_name(now):
+    return f'{DAILY_COUNTER_PREFIX}{date.fromtimestamp(now).isoformat()}'
+
+
+def _daily_key(product_id, event_type, region=None):
+    if region:
+        return f"{product_id}:{event_type}:{region}"
+    return f"{product_id}:{event_type}"
+
+
+def trending_reason(product, purchases_today):
+    """Explain why a product is trending"""
+    if purchases_today >= 10:
+        return "الأكثر مبيعاً اليوم"
+    if product.get('discount', 0) >= 25:
+        return "عرض محدود الوقت"
+    return "ترند جديد في الموضة"
+
+
+def trending_scores(ranking):
+    """Scale decayed scores to 0-100 relative to the leader"""
+    top_score = ranking[0][1] if ranking else 0
+    if top_score <= 0:
+        return [0 for _ in ranking]
+    return [round(100 * score / top_score) for _, score in ranking]
@@ -0,0 +1,262 @@
+import heapq
+import importlib
+import itertools
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Queue priorities accepted by `TryOnJobQueue.submit`, most urgent first
+PRIORITIES = {
+    'high': 0,
+    'normal': 1,
+    'low': 2
+}
+
+# Assumed duration of a job until some have finished
+DEFAULT_JOB_SECONDS = 30.0
+
+
+class QueueFull(Exception):
+    """Raised by `TryOnJobQueue.submit` when the wait queue is at capacity"""
+
+    def __init__(self, queued, retry_after):
+        super().__init__(f"Try-on queue is full ({queued} jobs waiting)")
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+# Worker processes: progress reports go back to the parent over this queue
+_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _run_job(renderer, job_id, payload):
+    def report(progress, step=None):
+        _progress_queue.put((job_id, progress, step))
+    return renderer(payload, report)
+
+
+def load_renderer(path):
+    """Import a renderer from a ``"module:function"`` path"""
+    module_name, _, name = path.partition(':')
+    return getattr(importlib.import_module(module_name), name)
+
+
+# Seconds the stub renderer spends on each step
+STUB_STEP_SECONDS = 1.0
+
+# Steps of the stub renderer as (progress when done, step description)
+STUB_STEPS = (
+    (30, "تحليل الصورة الشخصية..."),
+    (60, "تحليل المنتج وخصائصه..."),
+    (90, "تطبيق المنتج على الصورة..."),
+)
+
+
+def stub_render(payload, report, step_seconds=STUB_STEP_SECONDS):
+    """Local stand-in for the try-on model, returning a mock result
+
+    Sleeps `step_seconds` per step and reports progress as it goes; use
+    ``functools.partial(stub_render, step_seconds=0)`` for fast tests.
+    """
+    for progress, step in STUB_STEPS:
+        report(progress - 30, step)
+        time.sleep(step_seconds)
+    report(100, "تم الانتهاء!")
+    return {
+        "result_image": "https://images.unsplash.com/photo-1515372039744-b8f02a3ae446?w=400&h=600&fit=crop",
+        "confidence_score": random.randint(85, 98),
+        "ai_feedback": generate_ai_feedback(payload.get('product_id')),
+        "fit_analysis": {
+            "overall_fit": "ممتاز",
+            "color_match": "مناسب جداً",
+            "style_compatibility": "متوافق مع أسلوبك",
+            "size_recommendation": "المقاس M مناسب لك"
+        }
+    }
+
+
+def generate_ai_feedback(product_id):
+    """Generate AI feedback for virtual try-on result"""
+    feedback_options = [
+        {
+            "overall": "هذا المنتج يبدو رائعاً عليك! اللون يتماشى بشكل مثالي مع لون بشرتك.",
+            "pros": ["اللون مناسب جداً", "القصة تبرز نقاط القوة في جسمك", "الأسلوب يتماشى مع شخصيتك"],
+            "suggestions": ["يمكنك إضافة إكسسوارات ذهبية لإطلالة أكثر أناقة", "حذاء بكعب متوسط سيكمل الإطلالة"]
+        },
+        {
+            "overall": "خيار جيد! هذا المنتج مناسب لك ولكن يمكن تحسين الإطلالة ببعض التعديلات.",
+            "pros": ["المقاس مناسب", "الجودة تبدو عالية", "مناسب للمناسبات المختلفة"],
+            "suggestions": ["جرب لون أفتح للحصول على إطلالة أكثر إشراقاً", "أضف حزام لإبراز الخصر"]
+        },
+        {
+            "overall": "إطلالة مميزة! هذا المنتج يناسب أسلوبك الشخصي بشكل كبير.",
+            "pros": ["يبرز شخصيتك المميزة", "مريح وعملي", "يناسب عدة مناسبات"],
+            "suggestions": ["اختر إكسسوارات بسيطة لتوازن الإطلالة", "يمكن تنسيقه مع قطع أخرى بسهولة"]
+        }
+    ]
+
+    return random.choice(feedback_options)
+
+
+def default_mp_context():
+    """Return the multiprocessing context for new worker pools"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class TryOnJobQueue:
+    """Bounded priority queue of try-on jobs run by a process pool
+
+    At most `workers` jobs run at once, in worker processes, so rendering
+    never blocks request threads; up to `max_queued` more wait in a heap
+    ordered by (priority, submission order), and `submit` raises QueueFull
+    beyond that. `renderer(payload, report)` must be a module-level
+    function (it is pickled by reference); it calls ``report(progress,
+    step)`` as it goes and returns the result dict.
+
+    Listeners are called as ``listener(job_id, event, changes)`` with
+    event 'queued' (also sent as a waiting job moves up), 'started',
+    'progress', 'completed' or 'failed' and the changed session fields.
+    They run on the queue's internal threads and should return quickly.
+
+    The pool is started on the first job. Workers come from a forkserver
+    (spawn where that is unavailable) rather than a fork of the serving
+    process, which holds the catalog, threads and locks.
+    """
+
+    def __init__(self, renderer=stub_render, workers=2, max_queued=64, mp_context=None):
+        self.renderer = renderer
+        self.workers = workers
+        self.max_queued = max_queued
+        self._mp_context = mp_context or default_mp_context()
+        self._lock = threading.RLock()
+        self._waiting = []  # heap of (priority, seq, job_id, payload)
+        self._running = {}  # job id -> future
+        self._seq = itertools.count()
+        self._executor = None
+        self._progress_queue = None
+        self._listeners = []
+        self.avg_seconds = DEFAULT_JOB_SECONDS
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, job_id, event, changes):
+        for listener in self._listeners:
+            listener(job_id, event, changes)
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            if self._progress_queue is None:
+                self._progress_queue = self._mp_context.SimpleQueue()
+                threading.Thread(target=self._read_progress, name='tryon-progress', daemon=True).start()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=self._mp_context,
+                initializer=_init_worker, initargs=(self._progress_queue,)
+            )
+        return self._executor
+
+    def submit(self, job_id, payload, priority='normal'):
+        """Queue a job; returns its queue position (0 when it started right away)
+
+        Raises QueueFull when `max_queued` jobs are already waiting.
+        """
+        rank = PRIORITIES.get(priority, PRIORITIES['normal'])
+        with self._lock:
+            if len(self._running) < self.workers:
+                self._start(job_id, payload)
+                return 0
+            if len(self._waiting) >= self.max_queued:
+                self.rejected += 1
+                raise QueueFull(len(self._waiting), self.wait_seconds(len(self._waiting) + 1))
+            entry = (rank, next(self._seq), job_id, payload)
+            heapq.heappush(self._waiting, entry)
+            position = sorted(self._waiting).index(entry) + 1
+            self._notify(job_id, 'queued', {"status": "queued", "progress": 0, "queue_position": position})
+        return position
+
+    def _start(self, job_id, payload):
+        # Called with the lock held, which also serializes notifications
+        started_at = time.monotonic()
+        try:
+            future = self._ensure_executor().submit(_run_job, self.renderer, job_id, payload)
+        except BrokenProcessPool:
+            self._executor = None
+            future = self._ensure_executor().submit(_run_job, self.renderer, job_id, payload)
+        self._running[job_id] = future
+        self._notify(job_id, 'started', {"status": "processing", "queue_position": 0})
+        future.add_done_callback(lambda f: self._finished(job_id, f, started_at))
+
+    def _finished(self, job_id, future, started_at):
+        with self._lock:
+            self._running.pop(job_id, None)
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                self._executor = None
+                event, changes = 'failed', {"status": "failed", "error": str(e) or "Worker process died"}
+            except Exception as e:
+                event, changes = 'failed', {"status": "failed", "error": str(e)}
+            else:
+                elapsed = time.monotonic() - started_at
+                self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+                event = 'completed'
+                changes = {"status": "completed", "progress": 100, "current_step": "تم الانتهاء!", "result": result}
+            if event == 'completed':
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._notify(job_id, event, changes)
+            if self._waiting:
+                _, _, next_id, payload = heapq.heappop(self._waiting)
+                self._start(next_id, payload)
+                # Everyone still waiting moved up one place
+                for position, entry in enumerate(sorted(self._waiting), start=1):
+                    self._notify(entry[2], 'queued', {"queue_position": position})
+
+    def _read_progress(self):
+        while True:
+            job_id, progress, step = self._progress_queue.get()
+            with self._lock:
+                # Reports may arrive after the job finished; drop those
+                if job_id in self._running:
+                    self._notify(job_id, 'progress', {"progress": progress, "current_step": step})
+
+    def position(self, job_id):
+        """Return a waiting job's 1-based queue position, 0 if running, else None"""
+        with self._lock:
+            if job_id in self._running:
+                return 0
+            for position, entry in enumerate(sorted(self._waiting), start=1):
+                if entry[2] == job_id:
+                    return position
+        return None
+
+    def wait_seconds(self, position):
+        """Estimate the seconds until a job at `position` finishes"""
+        return round((position // self.workers + 1) * self.avg_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": len(self._running),
+                "queued": len(self._waiting),
+                "max_queued": self.max_queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_seconds": round(self.avg_seconds, 2)
+            }
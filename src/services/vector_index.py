@@ -0,0 +1,298 @@
+import logging
+import math
+import threading
+import zlib
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+from src.services.search_index import normalize_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Feature weights for the hashed product vectors
+FEATURE_WEIGHTS = {
+    'category': 2.0,
+    'style': 2.0,
+    'color': 1.5,
+    'brand': 1.0,
+    'tags': 1.0,
+    'title': 0.5
+}
+PRICE_WEIGHT = 1.5
+
+# Vectors scored against the centroids at once when assigning inverted lists
+ASSIGN_CHUNK_SIZE = 8192
+
+# Products vectorized at once by the background thread
+VECTORIZE_BATCH_SIZE = 1024
+
+# Smallest overflow matrix allocated after training
+OVERFLOW_MIN_ROWS = 1024
+
+# Trained IVF index for one catalog load
+IVFState = namedtuple('IVFState', ['ids', 'positions', 'vectors', 'centroids', 'lists'])
+
+
+def _bucket(feature, dim):
+    """Stable (process-independent) hash of a feature to (index, sign)"""
+    h = zlib.crc32(feature.encode('utf-8'))
+    return h % (dim - 1), 1.0 if (h >> 16) & 1 else -1.0
+
+
+def product_vector(product, dim):
+    """Build the L2-normalized feature vector of a product
+
+    Categorical fields and text tokens are feature-hashed into the first
+    ``dim - 1`` components; the last one carries the log-scaled price.
+    """
+    return product_vectors([product], dim)[0]
+
+
+def product_vectors(products, dim):
+    """Build the normalized vectors of several products as one float32 matrix"""
+    vectors = np.zeros((len(products), dim), dtype=np.float32)
+    for vector, product in zip(vectors, products):
+        for field, weight in FEATURE_WEIGHTS.items():
+            value = product.get(field)
+            if not value:
+                continue
+            if field in ('tags', 'title'):
+                values = value if isinstance(value, (list, tuple)) else [value]
+                features = [token for v in values for token in tokenize(v)]
+            else:
+                features = [normalize_text(value)]
+            for feature in features:
+                index, sign = _bucket(f'{field}:{feature}', dim)
+                vector[index] += sign * weight
+        price = product.get('price', 0) or 0
+        vector[dim - 1] = PRICE_WEIGHT * math.log1p(max(price, 0)) / math.log1p(10000)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors, where=norms > 0)
+
+
+class VectorIndex:
+    """Approximate nearest-neighbour index over product feature vectors
+
+    An IVF (inverted file) index: k-means centroids partition the vectors
+    and a query only scans the `nprobe` closest partitions, which is the
+    recall/latency knob (nprobe >= nlist is an exact search).
+
+    The catalog listener only records changed ids; the `vector-index`
+    thread vectorizes them in batches into an overflow matrix that every
+    query scans exactly, and masks their old rows in the trained lists.
+    The index is retrained on that thread after a load and once the
+    overflow grows past `retrain_ratio` of the catalog.
+    """
+
+    def __init__(self, catalog, dim=128, nprobe=8, iterations=8, sample_size=20000,
+                 retrain_ratio=0.1, seed=0):
+        self.catalog = catalog
+        self.dim = dim
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.retrain_ratio = retrain_ratio
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._state = None
+        self._pending = set()  # ids changed since the thread last looked
+        self._retrain = True
+        self._reset_overflow(0)
+
+    @property
+    def available(self):
+        return np is not None
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def on_catalog_change(self, event, products=None, changes=None):
+        """Catalog listener; queues the changed ids for the `vector-index` thread"""
+        if np is None:
+            return
+        with self._lock:
+            if event == 'load':
+                # Keep answering from the previous index until retrained
+                self._pending = set()
+                self._retrain = True
+            else:
+                self._pending.update((product or old)['id'] for product, old in changes)
+        self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='vector-index', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _reset_overflow(self, trained):
+        # Called with the lock held (or before the thread starts)
+        capacity = max(OVERFLOW_MIN_ROWS, int(self.retrain_ratio * trained) + 1)
+        self._overflow_ids = np.full(capacity, -1, dtype=np.int64) if np is not None else None
+        self._overflow_vectors = np.zeros((capacity, self.dim), dtype=np.float32) if np is not None else None
+        self._overflow_rows = {}  # product id -> overflow row
+        self._overflow_size = 0
+        self._masked = np.zeros(trained, dtype=bool) if np is not None else None  # superseded trained rows
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while True:
+                with self._lock:
+                    changed, self._pending = self._pending, set()
+                    retrain = self._retrain
+                    self._retrain = False
+                try:
+                    if retrain:
+                        # Ids taken above are all in this snapshot; later ones
+                        # are pending again and land in the fresh overflow
+                        state = self.build(self.catalog.snapshot().products())
+                        with self._lock:
+                            self._state = state
+                            self._reset_overflow(len(state.ids))
+                    elif changed:
+                        self._update(list(changed))
+                    else:
+                        break
+                except Exception:
+                    logger.exception("Vector index update failed")
+                    if retrain:
+                        with self._lock:
+                            self._retrain = True  # try again on the next change
+                    break
+
+    def _update(self, ids):
+        """Vectorize changed products into the overflow in batches"""
+        for start in range(0, len(ids), VECTORIZE_BATCH_SIZE):
+            batch = ids[start:start + VECTORIZE_BATCH_SIZE]
+            products = [self.catalog.get(product_id) for product_id in batch]
+            live = [p for p in products if p is not None]
+            vectors = product_vectors(live, self.dim)
+            with self._lock:
+                state = self._state
+                masked = self._masked.copy()  # queries may hold the current mask
+                for product_id in batch:
+                    position = state.positions.get(product_id) if state is not None else None
+                    if position is not None:
+                        masked[position] = True
+                    row = self._overflow_rows.pop(product_id, None)
+                    if row is not None:
+                        self._overflow_ids[row] = -1
+                for product, vector in zip(live, vectors):
+                    self._append_overflow(product['id'], vector)
+                self._masked = masked
+                trained = len(state.ids) if state is not None else 0
+                if state is None or len(self._overflow_rows) > self.retrain_ratio * max(trained, 1):
+                    self._retrain = True
+                    self._wake.set()
+
+    def _append_overflow(self, product_id, vector):
+        # Rows are only appended, so queries can read the arrays without
+        # copying them; a full matrix is replaced by a bigger one
+        size = self._overflow_size
+        if size == len(self._overflow_ids):
+            ids = np.full(2 * size, -1, dtype=np.int64)
+            ids[:size] = self._overflow_ids
+            vectors = np.zeros((2 * size, self.dim), dtype=np.float32)
+            vectors[:size] = self._overflow_vectors
+            self._overflow_ids, self._overflow_vectors = ids, vectors
+        self._overflow_vectors[size] = vector
+        self._overflow_ids[size] = product_id
+        self._overflow_rows[product_id] = size
+        self._overflow_size = size + 1
+
+    def build(self, products):
+        """Train an IVF index over the given products"""
+        ids = np.array([p['id'] for p in products], dtype=np.int64)
+        positions = {p['id']: i for i, p in enumerate(products)}
+        if not products:
+            return IVFState(ids, positions, np.zeros((0, self.dim), dtype=np.float32),
+                            np.zeros((0, self.dim), dtype=np.float32), [])
+        vectors = product_vectors(products, self.dim)
+
+        nlist = max(1, int(math.sqrt(len(products))))
+        rng = np.random.default_rng(self.seed)
+        sample = vectors
+        if len(vectors) > self.sample_size:
+            sample = vectors[rng.choice(len(vectors), self.sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), min(nlist, len(sample)), replace=False)]
+
+        # Spherical k-means on the sample
+        for _ in range(self.iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = sample[assignment == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    if norm:
+                        centroids[c] = centroid / norm
+
+        # Assign in fixed-size chunks so the similarity matrix stays small
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+            chunk = vectors[start:start + ASSIGN_CHUNK_SIZE]
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(1, len(centroids)))
+        lists = np.split(order, bounds)
+        return IVFState(ids, positions, vectors, centroids, lists)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def search(self, product_id, k=6, nprobe=None):
+        """Return up to `k` ``(product_id, similarity)`` pairs closest to a product
+
+        Returns None while the index has not been trained yet.
+        """
+        product = self.catalog.get(product_id)
+        if product is None or np is None:
+            return []
+        with self._lock:
+            state = self._state
+            masked = self._masked
+            size = self._overflow_size
+            overflow_ids = self._overflow_ids[:size]
+            overflow_vectors = self._overflow_vectors[:size]
+        if state is None:
+            self._start()
+            return None
+        query = product_vector(product, self.dim)
+        nprobe = self.nprobe if nprobe is None else max(1, nprobe)
+
+        candidate_ids = []
+        candidate_scores = []
+        if len(state.centroids):
+            probes = np.argsort(-(state.centroids @ query))[:nprobe]
+            rows = np.concatenate([state.lists[c] for c in probes])
+            # Changed or removed products are answered from the overflow
+            rows = rows[~masked[rows]]
+            if len(rows):
+                candidate_ids.append(state.ids[rows])
+                candidate_scores.append(state.vectors[rows] @ query)
+        if size:
+            candidate_ids.append(overflow_ids)
+            candidate_scores.append(overflow_vectors @ query)
+        if not candidate_ids:
+            return []
+
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        keep = (ids != product_id) & (ids >= 0)
+        ids, scores = ids[keep], scores[keep]
+
+        k = min(k, len(ids))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in top]
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Make `src` importable when pytest is run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the app's on-disk state out of the instance folder
+_state_dir = tempfile.mkdtemp(prefix='fashion-ai-tests-')
+os.environ.setdefault('SKETCH_SHARE_DIR', os.path.join(_state_dir, 'sketches'))
+os.environ.setdefault('TRYON_IMAGE_DIR', os.path.join(_state_dir, 'tryon-images'))
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from src.services import catalog as catalog_module
+from src.services.catalog import CatalogStore, SortedBlocks
+
+
+def product(product_id, **fields):
+    return {'id': product_id, 'title': f'product {product_id}', 'price': 10, **fields}
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(catalog_module, 'BLOCK_SIZE', 4)
+
+
+def test_sorted_blocks_stay_ordered(small_blocks):
+    rng = random.Random(3)
+    expected = sorted(rng.sample(range(1000), 100))
+    blocks = SortedBlocks.from_sorted(expected)
+    for _ in range(200):
+        removed = rng.sample(expected, min(len(expected), rng.randint(0, 5)))
+        added = [value for value in rng.sample(range(1000), rng.randint(0, 5)) if value not in expected]
+        previous, before = blocks, list(blocks)
+        blocks = blocks.updated(removed, added)
+        expected = sorted(set(expected) - set(removed) | set(added))
+        assert list(blocks) == expected
+        assert len(blocks) == len(expected)
+        assert list(previous) == before  # the old sequence is untouched
+        lo, hi = sorted(rng.sample(range(1000), 2))
+        assert list(blocks.irange(lo, hi)) == [value for value in expected if lo <= value <= hi]
+        assert list(blocks.irange(lo, hi, lo_inclusive=False)) == [value for value in expected if lo < value <= hi]
+
+
+def test_snapshot_is_isolated_from_later_writes():
+    store = CatalogStore([product(1, category='a', price=5), product(2, category='b', price=50)])
+    snapshot = store.snapshot()
+    store.apply([
+        ('upsert', product(3, category='a', price=7)),
+        ('patch', 1, {'category': 'b', 'price': 60}),
+        ('remove', 2),
+    ])
+
+    assert snapshot.version == store.version - 1
+    assert len(snapshot) == 2
+    assert snapshot.get(1)['category'] == 'a'
+    assert snapshot.get(2) is not None and snapshot.get(3) is None
+    assert snapshot.posting('category', 'a') == {1}
+    assert [p['id'] for p in snapshot.filter(min_price=0, max_price=10)] == [1]
+
+    assert store.get(1)['category'] == 'b'
+    assert store.get(2) is None
+    assert store.posting('category', 'a') == {3}
+    assert store.posting('category', 'b') == {1}
+    assert [p['id'] for p in store.filter(min_price=0, max_price=10)] == [3]
+
+
+def test_mixed_batch_is_rejected_atomically():
+    store = CatalogStore([product(1), product(2)])
+    events = []
+    store.subscribe(lambda event, **kwargs: events.append(event))
+    version = store.version
+
+    with pytest.raises(KeyError):
+        store.apply([('upsert', product(3)), ('remove', 2), ('patch', 2, {'price': 1})])
+    with pytest.raises(ValueError):
+        store.apply([('upsert', product(4)), ('rename', 1)])
+
+    assert store.version == version
+    assert sorted(p['id'] for p in store) == [1, 2]
+    assert events == []
+
+
+def test_batch_notifies_listeners_once():
+    store = CatalogStore([product(1), product(2)])
+    events = []
+    store.subscribe(lambda event, **kwargs: events.append((event, kwargs.get('changes'))))
+
+    assert store.apply([('upsert', product(3)), ('patch', 1, {'price': 20}), ('remove', 2)]) == 3
+
+    [(event, changes)] = events
+    assert event == 'apply'
+    assert [(new and new['id'], old and old['id']) for new, old in changes] == [(3, None), (1, 1), (None, 2)]
@@ -0,0 +1,53 @@
+import pytest
+
+from src.main import app, catalog
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_mixed_delta_batch_is_rejected_atomically(client):
+    version = catalog.version
+    response = client.post('/api/products/deltas', json={'deltas': [
+        {'op': 'upsert', 'product': {'id': 9101, 'title': 'new', 'price': 10}},
+        {'op': 'remove', 'id': 3},
+        {'op': 'patch', 'id': 3, 'changes': {'price': 5}},
+    ]})
+
+    assert response.status_code == 400
+    assert catalog.version == version
+    assert catalog.get(9101) is None
+    assert catalog.get(3) is not None
+
+
+@pytest.mark.parametrize('changes', [
+    {'title': None},
+    {'category': ['a']},
+    {'sizes': 5},
+    {'price': -1},
+    {'stock': 3},
+])
+def test_invalid_patch_is_rejected(client, changes):
+    before = catalog.get(1)
+    response = client.patch('/api/products/1', json=changes)
+
+    assert response.status_code == 400
+    assert catalog.get(1) is before
+
+
+def test_patched_text_tags_are_parsed_like_an_import(client):
+    tags = catalog.get(1)['tags']
+    try:
+        response = client.patch('/api/products/1', json={'tags': 'abc|def'})
+        assert response.status_code == 200
+        assert list(catalog.get(1)['tags']) == ['abc', 'def']
+    finally:
+        client.patch('/api/products/1', json={'tags': list(tags)})
+
+
+def test_patch_without_json_body_is_rejected(client):
+    response = client.patch('/api/products/1', data='price=5', content_type='text/plain')
+
+    assert response.status_code == 400
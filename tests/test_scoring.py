@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from src.main import FashionAIEngine
+from src.services.catalog import CatalogStore
+from src.services.scoring import CatalogScorer
+
+STYLES = ['casual', 'trendy', 'classic', 'formal', 'صيفي', None]
+CATEGORIES = ['فستان', 'تنورة', 'جاكيت', 'بدلة', 'حذاء', '', None]
+PRICES = [0, 50, 99.5, 100, 150, 300, 301, 500, 999, 1000, 2000]
+
+
+def random_product(rng, product_id):
+    product = {'id': product_id, 'title': f'product {product_id}', 'price': rng.choice(PRICES)}
+    for field, values in (('style', STYLES), ('category', CATEGORIES)):
+        value = rng.choice(values)
+        if value is not None:
+            product[field] = value
+    return product
+
+
+def random_profile(rng):
+    profile = {}
+    choices = (
+        ('style', STYLES + ['x']),
+        ('body_type', ['hourglass', 'rectangle', 'pear', '', None]),
+        ('budget', ['0-100', '100-300', '300-500', '500-1000', '1000+', 'other', '']),
+        ('age', [None, 0, 10, 18, 25, 26, 35, 36, 80, '30']),
+    )
+    for field, values in choices:
+        value = rng.choice(values)
+        if value is not None or rng.random() < 0.5:
+            profile[field] = value
+    return profile
+
+
+def rule_based_scores(profile, catalog):
+    return {product['id']: FashionAIEngine.calculate_match_score(profile, product) for product in catalog}
+
+
+def make_scorer(products):
+    catalog = CatalogStore(products)
+    scorer = CatalogScorer(catalog)
+    catalog.subscribe(scorer.on_catalog_change, prepare_load=scorer.prepare_load)
+    return catalog, scorer
+
+
+def test_vectorized_ranking_matches_rule_based():
+    rng = random.Random(1)
+    catalog, scorer = make_scorer([random_product(rng, i) for i in range(1, 1001)])
+    for _ in range(100):
+        profile = random_profile(rng)
+        expected = rule_based_scores(profile, catalog)
+        ranked = sorted(catalog, key=lambda product: -expected[product['id']])
+        assert [(product['id'], score) for product, score in scorer.top_k(profile, len(catalog))] == \
+            [(product['id'], expected[product['id']]) for product in ranked]
+
+
+def test_vectorized_scores_follow_incremental_changes():
+    rng = random.Random(2)
+    catalog, scorer = make_scorer([random_product(rng, i) for i in range(1, 501)])
+    for _ in range(20):
+        deltas = []
+        for _ in range(10):
+            product_id = rng.randint(1, 600)
+            roll = rng.random()
+            if roll < 0.4:
+                deltas.append(('upsert', random_product(rng, product_id)))
+            elif roll < 0.8 and catalog.get(product_id) is not None:
+                deltas.append(('patch', product_id, {'price': rng.choice(PRICES), 'style': rng.choice(STYLES[:-1])}))
+            else:
+                deltas.append(('remove', product_id))
+        catalog.apply(deltas)
+        profile = random_profile(rng)
+        scores = {product['id']: score for product, score in scorer.top_k(profile, len(catalog))}
+        assert scores == rule_based_scores(profile, catalog)
@@ -0,0 +1,86 @@
+import random
+
+from src.services.catalog import CatalogStore
+from src.services.similarity import MAX_CANDIDATES, SIMILARITY_THRESHOLD, NeighborTable, similarity_score
+
+PRICES = [7.5, 10, 14, 15, 20, 22.5, 30, 40, 100]
+
+
+def random_product(rng, product_id):
+    return {
+        'id': product_id,
+        'title': f'product {product_id}',
+        'price': rng.choice(PRICES),
+        'category': rng.choice('ab'),
+        'style': rng.choice('st'),
+        'brand': rng.choice('xyz'),
+    }
+
+
+def brute_force(catalog, reference, k):
+    scored = [
+        (similarity_score(reference, product), product['id'])
+        for product in catalog if product['id'] != reference['id']
+    ]
+    scored = sorted((item for item in scored if item[0] >= SIMILARITY_THRESHOLD), key=lambda item: (-item[0], item[1]))
+    return scored[:k], len(scored)
+
+
+def make_table(products, k=3):
+    catalog = CatalogStore()
+    table = NeighborTable(catalog, k=k)
+    catalog.subscribe(table.on_catalog_change)
+    table.start()
+    catalog.load(products)
+    table.join()
+    return catalog, table
+
+
+def assert_matches_brute_force(catalog, table, k):
+    for product in catalog:
+        expected, total = brute_force(catalog, product, k)
+        entry = table._table.get(product['id'])
+        if entry is not None:
+            assert entry[0] == expected
+        results, found = table.neighbors(product['id'])
+        assert [(score, neighbor['id']) for neighbor, score in results] == expected
+        assert found == total
+
+
+def test_neighbors_match_brute_force_after_changes():
+    rng = random.Random(5)
+    catalog, table = make_table([random_product(rng, i) for i in range(60)])
+    assert_matches_brute_force(catalog, table, 3)
+    for _ in range(150):
+        deltas = []
+        for _ in range(rng.randint(1, 4)):
+            product_id = rng.randint(0, 80)
+            roll = rng.random()
+            if roll < 0.5:
+                deltas.append(('upsert', random_product(rng, product_id)))
+            elif roll < 0.8 and catalog.get(product_id) is not None:
+                deltas.append(('patch', product_id, {'price': rng.choice(PRICES)}))
+            else:
+                deltas.append(('remove', product_id))
+        catalog.apply(deltas)
+        table.join()
+        for product_id, entry in list(table._table.items()):
+            product = catalog.get(product_id)
+            if product is not None:
+                assert entry[0] == brute_force(catalog, product, 3)[0]
+    assert_matches_brute_force(catalog, table, 3)
+
+
+def test_top_group_larger_than_candidate_cap_keeps_closest_prices():
+    # Every product shares category, style and brand, so only the price
+    # bonus separates them; the best ones must not be lost to the cap
+    products = [
+        {'id': i, 'title': f'product {i}', 'category': 'a', 'style': 's', 'brand': 'x', 'price': 1000 - i % 900}
+        for i in range(4 * MAX_CANDIDATES)
+    ]
+    catalog, table = make_table(products, k=6)
+    for product_id in (0, 899, 4 * MAX_CANDIDATES - 1):
+        results, total = table.neighbors(product_id)
+        expected, expected_total = brute_force(catalog, catalog.get(product_id), 6)
+        assert [(score, neighbor['id']) for neighbor, score in results] == expected
+        assert total == expected_total